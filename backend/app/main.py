@@ -42,7 +42,7 @@ async def options_handler(request: Request, path: str):
         headers={
             "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
             "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, PATCH, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Requested-With",
+            "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Requested-With, Idempotency-Key",
             "Access-Control-Allow-Credentials": "true",
             "Access-Control-Max-Age": "86400",
         }
@@ -50,51 +50,44 @@ async def options_handler(request: Request, path: str):
 
 
 from app.routers import admin, teachers, students, auth
-from app.services.supabase import get_supabase_admin
+from app.services.cleanup import cleanup_loop, CLEANUP_INTERVAL_SECONDS
+from app.services.submission_queue import submission_queue
+from app.services.drafts import draft_store, DRAFT_FLUSH_INTERVAL
+from app.services.exam_scheduler import exam_scheduler, EXAM_SCHEDULER_ENABLED
+from app.services.change_feed import change_feed, change_feed_available
 import asyncio
-from datetime import datetime, timedelta, timezone
 
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
 app.include_router(teachers.router, prefix="/api/teacher", tags=["Teachers"])
 app.include_router(students.router, prefix="/api/student", tags=["Students"])
 
-async def delete_old_submissions():
-    """Background task to delete PDF submissions older than 24 hours."""
-    while True:
-        try:
-            sb = get_supabase_admin()
-            # Calculate 24 hours ago
-            cutoff_date = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
-            
-            # Find old submissions with files
-            old_subs = sb.table("submissions").select("id, file_url").lt("submitted_at", cutoff_date).not_.is_("file_url", "null").execute()
-            
-            for sub in (old_subs.data or []):
-                file_url = sub.get("file_url")
-                if file_url:
-                    # Extract file path from URL (assuming format: .../storage/v1/object/public/answers/path/to/file.pdf)
-                    try:
-                        file_path = file_url.split("/answers/")[-1]
-                        # Remove from storage
-                        sb.storage.from_("answers").remove([file_path])
-                    except Exception as e:
-                        print(f"Failed to delete file {file_url}: {e}")
-                    
-                    # Update DB record to remove file_url (or delete the record entirely based on rules, here we just remove the file payload to keep the submission record)
-                    sb.table("submissions").update({"file_url": None, "answers": {"info": "File auto-deleted after 24h"}}).eq("id", sub["id"]).execute()
-                    
-            print(f"[{datetime.now().isoformat()}] Cleaned up {len(old_subs.data or [])} old submissions.")
-        except Exception as e:
-            print(f"Error in delete_old_submissions task: {e}")
-            
-        # Sleep for 1 hour
-        await asyncio.sleep(3600)
-
 @app.on_event("startup")
 async def startup_event():
-    # Start the background task
-    asyncio.create_task(delete_old_submissions())
+    # Expired answer-file cleanup (single runner across workers via job lock)
+    if CLEANUP_INTERVAL_SECONDS > 0:
+        asyncio.create_task(cleanup_loop())
+    # Buffered submission ingestion (replays any unflushed journal entries)
+    if submission_queue is not None:
+        await submission_queue.start()
+    # Periodic batched persistence of autosaved drafts (0 persists each save immediately)
+    if DRAFT_FLUSH_INTERVAL > 0:
+        draft_store.start()
+    # Exam status transitions (scheduled → active → completed)
+    if EXAM_SCHEDULER_ENABLED:
+        exam_scheduler.start()
+    # Cache invalidation from database changes (LISTEN/NOTIFY)
+    if change_feed_available():
+        change_feed.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await change_feed.stop()
+    await exam_scheduler.stop()
+    await draft_store.stop()
+    if submission_queue is not None:
+        await submission_queue.stop()
 
 
 @app.get("/")
@@ -5,8 +5,8 @@ JWT verification and role-based access control via Supabase
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.services.supabase import get_supabase, get_supabase_admin
-import json
+from app.services.profiles import get_profile
+from app.services.token_verifier import verify_access_token, InvalidTokenError
 
 security = HTTPBearer()
 
@@ -21,28 +21,25 @@ async def get_current_user(
     token = credentials.credentials
 
     try:
-        sb = get_supabase()
-        # Verify token with Supabase Auth
-        user_response = sb.auth.get_user(token)
-        if not user_response or not user_response.user:
+        # Verify token locally (falls back to Supabase Auth when needed)
+        try:
+            user_id = await verify_access_token(token)
+        except InvalidTokenError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid or expired token"
             )
 
-        user_id = user_response.user.id
+        # Fetch profile (cached for a short TTL)
+        profile = await get_profile(user_id)
 
-        # Fetch profile from profiles table
-        sb_admin = get_supabase_admin()
-        profile = sb_admin.table("profiles").select("*").eq("id", user_id).single().execute()
-
-        if not profile.data:
+        if not profile:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User profile not found"
             )
 
-        return profile.data
+        return profile
 
     except HTTPException:
         raise
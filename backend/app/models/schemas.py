@@ -130,8 +130,14 @@ class QuestionResponse(BaseModel):
 # ──── Submissions ────
 
 class SubmissionCreate(BaseModel):
-    answers: dict  # { question_id: answer_value }
+    answers: dict = {}  # { question_id: answer_value }
     file_url: Optional[str] = None
+    use_draft: bool = False  # start from the autosaved draft; `answers` override it
+
+
+class DraftPatch(BaseModel):
+    answers: dict = {}  # changed answers only: { question_id: answer_value }
+    removed: List[str] = []  # question ids whose answer was cleared
 
 
 class SubmissionResponse(BaseModel):
@@ -151,6 +157,21 @@ class EvaluateSubmission(BaseModel):
     remarks: Optional[str] = None
 
 
+class EvaluateBatchItem(BaseModel):
+    submission_id: str
+    marks_obtained: int = Field(ge=0)
+    remarks: Optional[str] = None
+
+
+class GradeBand(BaseModel):
+    min_percentage: float = Field(ge=0, le=100)
+    grade: str = Field(min_length=1, max_length=8)
+
+
+class GradingScaleUpdate(BaseModel):
+    bands: List[GradeBand] = Field(min_length=1)
+
+
 class ResultResponse(BaseModel):
     id: str
     exam_id: str
@@ -190,4 +211,5 @@ class StudentDashboard(BaseModel):
     completed_exams: int
     total_submissions: int
     average_percentage: Optional[float] = None
+    performance: Optional[dict] = None  # student_performance row (best/worst, per-subject)
     recent_results: List[dict] = []
@@ -3,67 +3,157 @@ Admin Router
 Dashboard stats, user management (CRUD), system oversight
 """
 
-from fastapi import APIRouter, HTTPException, status, Depends, Query
-from app.models.schemas import UserRegister, UserResponse, UserUpdate, AdminDashboard
-from app.services.supabase import get_supabase_admin
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Response, UploadFile, File
+from fastapi.responses import StreamingResponse
+from app.models.schemas import UserRegister, UserResponse, UserUpdate, AdminDashboard, GradingScaleUpdate
+from app.services.supabase import get_async_supabase_admin, get_coalescing_stats
+from app.services.token_verifier import get_verification_stats
+from app.services.profiles import profile_cache, teacher_name_cache, invalidate_profile
+from app.services.exam_paper import paper_cache
+from app.services.grading import GradingScale, invalidate_scales, regrade_exams
+from app.services.submission_queue import submission_queue
+from app.services.drafts import draft_store
+from app.services.cleanup import run_cleanup, get_last_report, JobLockedError
+from app.services.exam_scheduler import exam_scheduler
+from app.services.change_feed import change_feed
+from app.services.user_import import UserImport
+from app.services.exports import ResultExport, MEDIA_TYPES, stream_export, xlsx_available
+from app.services.analytics import analytics_cache, invalidate_analytics
+from app.services.performance import rebuild_performance
+from app.services.pagination import (
+    NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, keyset_filter, ilike_any, prefix_pattern, fetch_all
+)
 from app.middleware.auth import require_role
+from app.services.cache import Cache, get_cache_stats
 from typing import Optional
+import asyncio
+import os
 
 router = APIRouter()
 
+# Short-lived dashboard snapshot shared by all admins (0 disables caching)
+ADMIN_DASHBOARD_CACHE_TTL = float(os.getenv("ADMIN_DASHBOARD_CACHE_TTL", "15"))
+DASHBOARD_TAG = "admin:dashboard"
+_dashboard_cache = Cache("admin_dashboard", ttl=ADMIN_DASHBOARD_CACHE_TTL, maxsize=1)
+_dashboard_lock = asyncio.Lock()
+
 
 @router.get("/dashboard", response_model=AdminDashboard)
-async def admin_dashboard(current_user: dict = Depends(require_role("admin"))):
+async def admin_dashboard(
+    refresh: bool = Query(False, description="Bypass the cached snapshot"),
+    current_user: dict = Depends(require_role("admin"))
+):
     """Get admin dashboard statistics."""
     try:
-        sb = get_supabase_admin()
-
-        # Count users by role
-        all_users = sb.table("profiles").select("role").execute()
-        users = all_users.data or []
-        total_teachers = sum(1 for u in users if u["role"] == "teacher")
-        total_students = sum(1 for u in users if u["role"] == "student")
-
-        # Count exams
-        exams = sb.table("exams").select("id", count="exact").execute()
-        total_exams = exams.count or 0
-
-        # Count submissions
-        submissions = sb.table("submissions").select("id", count="exact").execute()
-        total_submissions = submissions.count or 0
-
-        # Recent exams
-        recent = sb.table("exams").select("*").order("created_at", desc=True).limit(5).execute()
-
-        return AdminDashboard(
-            total_users=len(users),
-            total_teachers=total_teachers,
-            total_students=total_students,
-            total_exams=total_exams,
-            total_submissions=total_submissions,
-            recent_exams=recent.data or []
-        )
+        if not refresh:
+            cached = await _dashboard_cache.get("snapshot")
+            if cached is not None:
+                return cached
+
+        async with _dashboard_lock:
+            # Another admin may have rebuilt the snapshot while we waited
+            if not refresh:
+                cached = await _dashboard_cache.get("snapshot")
+                if cached is not None:
+                    return cached
+
+            versions = await _dashboard_cache.versions([DASHBOARD_TAG])
+            sb = await get_async_supabase_admin()
+
+            def count(table: str, **filters):
+                query = sb.table(table).select("id", count="exact", head=True)
+                for column, value in filters.items():
+                    query = query.eq(column, value)
+                return query.execute()
+
+            # All counts are computed by Postgres and fetched concurrently
+            users, teachers, students, exams, submissions, recent = await asyncio.gather(
+                count("profiles"),
+                count("profiles", role="teacher"),
+                count("profiles", role="student"),
+                count("exams"),
+                count("submissions"),
+                sb.table("exams").select("*").order("created_at", desc=True).limit(5).execute(),
+            )
+
+            snapshot = AdminDashboard(
+                total_users=users.count or 0,
+                total_teachers=teachers.count or 0,
+                total_students=students.count or 0,
+                total_exams=exams.count or 0,
+                total_submissions=submissions.count or 0,
+                recent_exams=recent.data or []
+            )
+            await _dashboard_cache.set("snapshot", snapshot.model_dump(mode="json"), tags=[DASHBOARD_TAG], versions=versions)
+            return snapshot
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch dashboard: {str(e)}")
 
 
+# Columns the user listing may return (the UserResponse fields)
+USER_LIST_COLUMNS = ("id", "email", "full_name", "role", "gender", "department", "reg_number", "created_at")
+
+
 @router.get("/users", response_model=list)
 async def list_users(
+    response: Response,
     role: Optional[str] = Query(None, description="Filter by role"),
+    department: Optional[str] = Query(None, description="Filter by department"),
+    reg_number: Optional[str] = Query(None, description="Registration number prefix"),
+    q: Optional[str] = Query(None, min_length=2, max_length=100, description="Search name or email"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size (omit to return all)"),
+    cursor: Optional[str] = Query(None, description=f"Value of the {NEXT_CURSOR_HEADER} header from the previous page"),
     current_user: dict = Depends(require_role("admin"))
 ):
-    """List all users, optionally filtered by role."""
+    """List users, newest first, with optional filters, search and keyset paging."""
     try:
-        sb = get_supabase_admin()
-        query = sb.table("profiles").select("*").order("created_at", desc=True)
+        columns = list(USER_LIST_COLUMNS)
+        if fields:
+            requested = [f.strip() for f in fields.split(",") if f.strip()]
+            unknown = set(requested) - set(USER_LIST_COLUMNS)
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+            # id and created_at are needed for the cursor
+            columns = list(dict.fromkeys(["id", "created_at", *requested]))
+
+        sb = await get_async_supabase_admin()
+        query = (
+            sb.table("profiles")
+            .select(", ".join(columns))
+            .order("created_at", desc=True)
+            .order("id", desc=True)
+        )
 
         if role:
             query = query.eq("role", role)
+        if department:
+            query = query.eq("department", department)
+        if reg_number:
+            query = query.like("reg_number", prefix_pattern(reg_number))
+        if q:
+            query = query.or_(ilike_any(["full_name", "email"], q.strip()))
+        if cursor:
+            try:
+                created_at, last_id = decode_cursor(cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            query = query.or_(keyset_filter("created_at", created_at, last_id))
+        if limit:
+            query = query.limit(limit)
+
+        result = await query.execute()
+        users = result.data or []
+
+        if limit and len(users) == limit:
+            last = users[-1]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last["created_at"], last["id"])
+
+        return users
 
-        result = query.execute()
-        return result.data or []
-
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch users: {str(e)}")
 
@@ -75,10 +165,10 @@ async def create_user(
 ):
     """Admin creates a new user (teacher or student)."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
 
         # Create in Supabase Auth
-        auth_response = sb.auth.admin.create_user({
+        auth_response = await sb.auth.admin.create_user({
             "email": user.email,
             "password": user.password,
             "email_confirm": True
@@ -99,7 +189,7 @@ async def create_user(
             "reg_number": user.reg_number,
         }
 
-        sb.table("profiles").insert(profile_data).execute()
+        await sb.table("profiles").insert(profile_data).execute()
 
         return {"message": "User created successfully", "user_id": user_id}
 
@@ -109,6 +199,25 @@ async def create_user(
         raise HTTPException(status_code=400, detail=f"Failed to create user: {str(e)}")
 
 
+@router.post("/users/import", response_model=dict)
+async def import_users(
+    file: UploadFile = File(..., description="CSV with a header row, or JSONL (one user object per line)"),
+    format: Optional[str] = Query(None, pattern="^(csv|jsonl)$", description="Defaults to the file extension"),
+    current_user: dict = Depends(require_role("admin"))
+):
+    """
+    Bulk-create users. Rows use the same fields as POST /users; invalid rows are
+    reported individually. Re-uploading the same file resumes an interrupted import.
+    """
+    fmt = format or ("jsonl" if (file.filename or "").lower().endswith((".jsonl", ".ndjson")) else "csv")
+    try:
+        return await UserImport().run(file, fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
+
+
 @router.put("/users/{user_id}", response_model=dict)
 async def update_user(
     user_id: str,
@@ -117,7 +226,7 @@ async def update_user(
 ):
     """Update a user's profile (role, name, department, etc.)."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
 
         update_data = {k: v for k, v in update.model_dump().items() if v is not None}
         if "role" in update_data:
@@ -126,7 +235,8 @@ async def update_user(
         if not update_data:
             raise HTTPException(status_code=400, detail="No fields to update")
 
-        result = sb.table("profiles").update(update_data).eq("id", user_id).execute()
+        result = await sb.table("profiles").update(update_data).eq("id", user_id).execute()
+        await invalidate_profile(user_id)
 
         return {"message": "User updated successfully"}
 
@@ -143,17 +253,18 @@ async def delete_user(
 ):
     """Delete a user from both Auth and profiles."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
 
         # Prevent self-deletion
         if user_id == current_user["id"]:
             raise HTTPException(status_code=400, detail="Cannot delete your own account")
 
         # Delete profile first
-        sb.table("profiles").delete().eq("id", user_id).execute()
+        await sb.table("profiles").delete().eq("id", user_id).execute()
+        await invalidate_profile(user_id)
 
         # Delete from Supabase Auth
-        sb.auth.admin.delete_user(user_id)
+        await sb.auth.admin.delete_user(user_id)
 
         return {"message": "User deleted successfully"}
 
@@ -161,3 +272,111 @@ async def delete_user(
         raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to delete user: {str(e)}")
+
+
+@router.put("/grading-scales/{department}", response_model=dict)
+async def set_department_grading_scale(
+    department: str,
+    scale: GradingScaleUpdate,
+    current_user: dict = Depends(require_role("admin"))
+):
+    """Set the grading scale for a department and regrade its teachers' exams."""
+    try:
+        sb = await get_async_supabase_admin()
+
+        try:
+            GradingScale((b.min_percentage, b.grade) for b in scale.bands)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        await sb.table("grading_scales").upsert(
+            {"department": department, "bands": [b.model_dump() for b in scale.bands]},
+            on_conflict="department",
+        ).execute()
+        await invalidate_scales()
+
+        # Exams set by this department's teachers (exam-level overrides still win)
+        exams = await fetch_all(
+            lambda: sb.table("exams").select("id, teacher:profiles!teacher_id!inner(department)").eq("teacher.department", department)
+        )
+        regraded = await regrade_exams([e["id"] for e in exams])
+        await invalidate_analytics()
+
+        return {"message": "Grading scale updated", "results_regraded": regraded}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to update grading scale: {str(e)}")
+
+
+@router.get("/results/export")
+async def export_marksheet(
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    department: Optional[str] = Query(None, description="Only students of this department"),
+    exam_id: Optional[str] = Query(None, description="Only this exam"),
+    published_only: bool = Query(False, description="Only published results"),
+    current_user: dict = Depends(require_role("admin"))
+):
+    """College-wide marksheet (results × students × exams) as CSV or XLSX (streamed)."""
+    try:
+        if format == "xlsx" and not xlsx_available():
+            raise HTTPException(status_code=400, detail="XLSX export is not available on this server (openpyxl not installed)")
+
+        export = ResultExport(exam_id=exam_id, department=department, published_only=published_only)
+        body = await stream_export(export, format)
+        filename = f"marksheet-{department or 'all'}.{format}"
+        return StreamingResponse(
+            body,
+            media_type=MEDIA_TYPES[format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+
+
+@router.post("/maintenance/cleanup", response_model=dict)
+async def cleanup_submission_files(
+    max_pages: Optional[int] = Query(None, ge=1, description="Stop after this many pages (resumes next run)"),
+    current_user: dict = Depends(require_role("admin"))
+):
+    """Remove expired submission files from storage (also suitable for cron triggers)."""
+    try:
+        return await run_cleanup(max_pages)
+    except JobLockedError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Cleanup failed: {str(e)}")
+
+
+@router.post("/maintenance/rebuild-performance", response_model=dict)
+async def rebuild_student_performance(current_user: dict = Depends(require_role("admin"))):
+    """Recompute every student's performance aggregates from published results."""
+    try:
+        students = await rebuild_performance()
+        return {"message": "Student performance rebuilt", "students": students}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Rebuild failed: {str(e)}")
+
+
+@router.get("/metrics", response_model=dict)
+async def service_metrics(current_user: dict = Depends(require_role("admin"))):
+    """Internal performance counters for this worker process."""
+    return {
+        "auth": get_verification_stats(),
+        "coalescing": get_coalescing_stats(),
+        "cache": get_cache_stats(),
+        "change_feed": change_feed.stats(),
+        "profile_cache": profile_cache.stats(),
+        "teacher_name_cache": teacher_name_cache.stats(),
+        "admin_dashboard_cache": _dashboard_cache.stats(),
+        "exam_paper_cache": paper_cache.stats(),
+        "analytics_cache": analytics_cache.stats(),
+        "submission_queue": submission_queue.stats() if submission_queue else {"enabled": False},
+        "drafts": draft_store.stats(),
+        "exam_scheduler": exam_scheduler.stats(),
+        "last_cleanup": get_last_report(),
+    }
@@ -5,7 +5,8 @@ Handles user registration, login, and profile retrieval
 
 from fastapi import APIRouter, HTTPException, status, Depends
 from app.models.schemas import UserRegister, UserLogin, UserResponse
-from app.services.supabase import get_supabase, get_supabase_admin, reset_clients
+from app.services.supabase import get_async_supabase, get_async_supabase_admin, reset_clients
+from app.services.profiles import get_profile
 from app.middleware.auth import get_current_user
 import errno
 
@@ -28,15 +29,15 @@ def _is_ebusy(exc: Exception) -> bool:
 
 
 @router.post("/register", response_model=dict)
-def register(user: UserRegister):
+async def register(user: UserRegister):
     """Register a new user via Supabase Auth and create a profile."""
     last_error = None
     for attempt in range(2):
         try:
-            sb_admin = get_supabase_admin()
+            sb_admin = await get_async_supabase_admin()
 
             # Create user in Supabase Auth
-            auth_response = sb_admin.auth.admin.create_user({
+            auth_response = await sb_admin.auth.admin.create_user({
                 "email": user.email,
                 "password": user.password,
                 "email_confirm": True
@@ -61,7 +62,7 @@ def register(user: UserRegister):
                 "reg_number": user.reg_number,
             }
 
-            sb_admin.table("profiles").insert(profile_data).execute()
+            await sb_admin.table("profiles").insert(profile_data).execute()
 
             return {
                 "message": "Registration successful",
@@ -93,15 +94,15 @@ def register(user: UserRegister):
 
 
 @router.post("/login", response_model=dict)
-def login(credentials: UserLogin):
+async def login(credentials: UserLogin):
     """Login user and return access token."""
     last_error = None
     for attempt in range(2):
         try:
-            sb = get_supabase()
+            sb = await get_async_supabase()
 
             # Sign in with Supabase Auth
-            auth_response = sb.auth.sign_in_with_password({
+            auth_response = await sb.auth.sign_in_with_password({
                 "email": credentials.email,
                 "password": credentials.password
             })
@@ -115,14 +116,13 @@ def login(credentials: UserLogin):
             user_id = auth_response.user.id
             token = auth_response.session.access_token
 
-            # Fetch profile
-            sb_admin = get_supabase_admin()
-            profile = sb_admin.table("profiles").select("*").eq("id", user_id).single().execute()
+            # Fetch profile (warms the cache used by get_current_user)
+            profile = await get_profile(user_id)
 
             return {
                 "access_token": token,
                 "token_type": "bearer",
-                "user": profile.data if profile.data else {
+                "user": profile if profile else {
                     "id": user_id,
                     "email": credentials.email
                 }
@@ -3,57 +3,75 @@ Student Router
 View exams, submit answers, view results
 """
 
-from fastapi import APIRouter, HTTPException, status, Depends
-from app.models.schemas import SubmissionCreate, StudentDashboard
-from app.services.supabase import get_supabase_admin
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Query, Request, Response
+from app.models.schemas import SubmissionCreate, DraftPatch, StudentDashboard
+from app.services.supabase import get_async_supabase_admin, coalesced
+from app.services.exam_paper import get_exam_paper
+from app.services.profiles import get_teacher_names
+from app.services.pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, keyset_filter
+from app.services.cache import TTLCache
+from app.services.submission_queue import submission_queue, QueueFullError
+from app.services.drafts import draft_store
+from app.services.exam_scheduler import exam_scheduler
+from app.services.performance import get_performance
 from app.middleware.auth import require_role
 from datetime import datetime, timezone
+from typing import Optional
+import asyncio
 
 router = APIRouter()
 
+# (student_id, exam_id, Idempotency-Key) -> submission id, for client retries
+_submission_keys = TTLCache(maxsize=20000, ttl=24 * 3600)
+
+
+def _without_missing_exam(results: list) -> list:
+    """Drop a null embedded `exam` so rows keep their previous shape."""
+    for r in results:
+        if r.get("exam") is None:
+            r.pop("exam", None)
+    return results
+
 
 @router.get("/dashboard", response_model=StudentDashboard)
 async def student_dashboard(current_user: dict = Depends(require_role("student"))):
     """Get student dashboard statistics."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
         student_id = current_user["id"]
 
-        # Upcoming / active exams
-        exams = sb.table("exams").select("*").in_("status", ["scheduled", "active"]).order("scheduled_at").execute()
+        # Independent queries, issued concurrently
+        exams, subs, performance, recent = await asyncio.gather(
+            # Upcoming / active exams
+            coalesced(
+                ("open_exams", "*"),
+                lambda: sb.table("exams").select("*").in_("status", ["scheduled", "active"]).order("scheduled_at").execute(),
+            ),
+            # Student's submissions (count only)
+            sb.table("submissions").select("id", count="exact", head=True).eq("student_id", student_id).execute(),
+            # Precomputed aggregates over published results
+            get_performance(student_id),
+            # Latest published results with exam info embedded
+            sb.table("results").select("*, exam:exams(title, subject)").eq("student_id", student_id).eq("published", True)
+                .order("evaluated_at", desc=True).limit(5).execute(),
+        )
         upcoming = exams.data or []
-
-        # Student's submissions
-        subs = sb.table("submissions").select("*").eq("student_id", student_id).execute()
-        total_submissions = len(subs.data or [])
-
-        # Completed exams (submitted)
-        submitted_exam_ids = [s["exam_id"] for s in (subs.data or [])]
-        completed_exams = len(set(submitted_exam_ids))
-
-        # Published results
-        results = sb.table("results").select("*").eq("student_id", student_id).eq("published", True).execute()
-        result_list = results.data or []
+        total_submissions = subs.count or 0
+        # UNIQUE(exam_id, student_id): one submission per completed exam
+        completed_exams = total_submissions
 
         average_percentage = None
-        if result_list:
-            percentages = [r["percentage"] for r in result_list if r.get("percentage") is not None]
-            if percentages:
-                average_percentage = round(sum(percentages) / len(percentages), 2)
-
-        # Enrich results with exam info
-        recent_results = []
-        for r in result_list[:5]:
-            exam = sb.table("exams").select("title, subject").eq("id", r["exam_id"]).single().execute()
-            if exam.data:
-                r["exam"] = exam.data
-            recent_results.append(r)
+        if performance and performance.get("average_percentage") is not None:
+            average_percentage = float(performance["average_percentage"])
+
+        recent_results = _without_missing_exam(recent.data or [])
 
         return StudentDashboard(
             upcoming_exams=upcoming,
             completed_exams=completed_exams,
             total_submissions=total_submissions,
             average_percentage=average_percentage,
+            performance=performance,
             recent_results=recent_results
         )
 
@@ -62,64 +80,135 @@ async def student_dashboard(current_user: dict = Depends(require_role("student")
 
 
 @router.get("/exams", response_model=list)
-async def list_available_exams(current_user: dict = Depends(require_role("student"))):
-    """List all scheduled/active exams for students."""
+async def list_available_exams(
+    response: Response,
+    department: Optional[str] = Query(None, description="Only exams set by teachers of this department"),
+    subject: Optional[str] = Query(None, description="Filter by subject"),
+    limit: Optional[int] = Query(None, ge=1, le=200, description="Page size (omit to return all)"),
+    cursor: Optional[str] = Query(None, description=f"Value of the {NEXT_CURSOR_HEADER} header from the previous page"),
+    current_user: dict = Depends(require_role("student"))
+):
+    """List scheduled/active exams for students, soonest first."""
     try:
-        sb = get_supabase_admin()
-        result = sb.table("exams").select("*").in_("status", ["scheduled", "active"]).order("scheduled_at").execute()
+        sb = await get_async_supabase_admin()
+        student_id = current_user["id"]
 
+        columns = "*, teacher:profiles!teacher_id!inner(department)" if department else "*"
+        query = (
+            sb.table("exams")
+            .select(columns)
+            .in_("status", ["scheduled", "active"])
+            .order("scheduled_at")
+            .order("id")
+        )
+        if department:
+            query = query.eq("teacher.department", department)
+        if subject:
+            query = query.eq("subject", subject)
+        if cursor:
+            try:
+                scheduled_at, last_id = decode_cursor(cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            query = query.or_(keyset_filter("scheduled_at", scheduled_at, last_id, desc=False))
+        if limit:
+            query = query.limit(limit)
+
+        # Exams and the student's submissions are independent
+        # Identical concurrent listings share one upstream request
+        result, subs = await asyncio.gather(
+            coalesced(("open_exams", columns, department, subject, cursor, limit), query.execute),
+            sb.table("submissions").select("exam_id").eq("student_id", student_id).execute(),
+        )
         exams = result.data or []
-
-        # Mark which exams student already submitted
-        student_id = current_user["id"]
-        subs = sb.table("submissions").select("exam_id").eq("student_id", student_id).execute()
         submitted_ids = {s["exam_id"] for s in (subs.data or [])}
 
+        # Teacher names: shared cache + one batched lookup for misses
+        teacher_names = await get_teacher_names(e["teacher_id"] for e in exams)
+
         for exam in exams:
+            exam.pop("teacher", None)
             exam["already_submitted"] = exam["id"] in submitted_ids
-            # Enrich with teacher name
-            teacher = sb.table("profiles").select("full_name").eq("id", exam["teacher_id"]).single().execute()
-            if teacher.data:
-                exam["teacher_name"] = teacher.data["full_name"]
+            if exam["teacher_id"] in teacher_names:
+                exam["teacher_name"] = teacher_names[exam["teacher_id"]]
+
+        if limit and len(exams) == limit:
+            last = exams[-1]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last["scheduled_at"], last["id"])
 
         return exams
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/exams/{exam_id}", response_model=dict)
-async def get_exam_with_questions(exam_id: str, current_user: dict = Depends(require_role("student"))):
+async def get_exam_with_questions(
+    exam_id: str,
+    request: Request,
+    current_user: dict = Depends(require_role("student"))
+):
     """Get exam details with questions (for taking exam)."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
 
-        # Get exam
-        exam = sb.table("exams").select("*").eq("id", exam_id).single().execute()
-        if not exam.data:
+        # Exam + sanitised questions are shared by every student (cached)
+        paper = await get_exam_paper(exam_id)
+        if paper is None:
             raise HTTPException(status_code=404, detail="Exam not found")
 
-        if exam.data["status"] not in ("scheduled", "active"):
+        if paper.exam["status"] not in ("scheduled", "active"):
             raise HTTPException(status_code=400, detail="This exam is not available")
 
         # Check if already submitted
-        existing = sb.table("submissions").select("id").eq("exam_id", exam_id).eq("student_id", current_user["id"]).execute()
+        existing = await sb.table("submissions").select("id").eq("exam_id", exam_id).eq("student_id", current_user["id"]).execute()
         if existing.data:
             raise HTTPException(status_code=400, detail="You have already submitted this exam")
 
-        # Get questions (hide correct answers)
-        questions = sb.table("questions").select("*").eq("exam_id", exam_id).order("order_num").execute()
-        q_list = questions.data or []
-        for q in q_list:
-            q.pop("correct_answer", None)  # Hide answers from students
+        headers = {"ETag": paper.etag, "Cache-Control": "private, no-cache"}
+        if request.headers.get("if-none-match") == paper.etag:
+            return Response(status_code=304, headers=headers)
+        return Response(content=paper.body, media_type="application/json", headers=headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 
-        exam_data = exam.data
-        exam_data["questions"] = q_list
+@router.patch("/exams/{exam_id}/draft", response_model=dict)
+async def save_draft(
+    exam_id: str,
+    patch: DraftPatch,
+    request: Request,
+    current_user: dict = Depends(require_role("student"))
+):
+    """Autosave: record changed answers for an in-progress exam (persisted in batches)."""
+    try:
+        paper = await get_exam_paper(exam_id)
+        if paper is None:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        if paper.exam["status"] not in ("scheduled", "active"):
+            raise HTTPException(status_code=400, detail="This exam is not available")
 
-        return exam_data
+        size = int(request.headers.get("content-length") or 0)
+        pending = await draft_store.save(exam_id, current_user["id"], patch.answers, patch.removed, size)
+        return {"message": "Draft saved", "pending_changes": pending}
 
     except HTTPException:
         raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/exams/{exam_id}/draft", response_model=dict)
+async def get_draft(exam_id: str, current_user: dict = Depends(require_role("student"))):
+    """Get the autosaved answers for an in-progress exam."""
+    try:
+        answers = await draft_store.load(exam_id, current_user["id"])
+        return {"exam_id": exam_id, "answers": answers}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -128,42 +217,77 @@ async def get_exam_with_questions(exam_id: str, current_user: dict = Depends(req
 async def submit_exam(
     exam_id: str,
     submission: SubmissionCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=200),
     current_user: dict = Depends(require_role("student"))
 ):
-    """Submit answers for an exam."""
+    """
+    Submit answers for an exam.
+    Retries carrying the same Idempotency-Key return the original submission id.
+    """
     try:
-        sb = get_supabase_admin()
         student_id = current_user["id"]
 
-        # Verify exam exists and is active
-        exam = sb.table("exams").select("*").eq("id", exam_id).single().execute()
-        if not exam.data:
-            raise HTTPException(status_code=404, detail="Exam not found")
-
-        if exam.data["status"] not in ("scheduled", "active"):
-            raise HTTPException(status_code=400, detail="This exam is not accepting submissions")
-
-        # Check for duplicate submission
-        existing = sb.table("submissions").select("id").eq("exam_id", exam_id).eq("student_id", student_id).execute()
-        if existing.data:
-            raise HTTPException(status_code=400, detail="Already submitted this exam")
-
         # Demand PDF file URL
         if not submission.file_url or not submission.file_url.endswith(".pdf"):
             raise HTTPException(status_code=400, detail="Submissions must be a PDF file.")
 
-        # Create submission
-        sub_data = {
-            "exam_id": exam_id,
-            "student_id": student_id,
-            "answers": submission.answers,
-            "file_url": submission.file_url,
-            "status": "submitted"
-        }
+        # Retry already seen by this worker: answer without another write
+        if idempotency_key:
+            cached_id = _submission_keys.get((student_id, exam_id, idempotency_key))
+            if cached_id:
+                return {"message": "Exam submitted successfully", "submission_id": cached_id}
+
+        # Deadline from the scheduler's in-memory exam windows (no extra fetch)
+        if not exam_scheduler.accepting_submissions(exam_id):
+            raise HTTPException(status_code=400, detail="The exam has ended")
+
+        answers = submission.answers
+        if submission.use_draft:
+            answers = {**await draft_store.load(exam_id, student_id), **submission.answers}
+
+        if submission_queue is not None:
+            # Buffered mode: validate against the cached exam, journal locally, flush later
+            paper = await get_exam_paper(exam_id)
+            if paper is None:
+                raise HTTPException(status_code=404, detail="Exam not found")
+            if paper.exam["status"] not in ("scheduled", "active"):
+                raise HTTPException(status_code=400, detail="This exam is not accepting submissions")
+            if not exam_scheduler.accepting_submissions(exam_id, paper.exam):
+                raise HTTPException(status_code=400, detail="The exam has ended")
+            try:
+                submission_id, created, stored_key = await submission_queue.accept(
+                    exam_id, student_id, answers, submission.file_url, idempotency_key
+                )
+            except QueueFullError as e:
+                raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "2"})
+        else:
+            # Status check + insert-on-conflict in one round trip
+            sb = await get_async_supabase_admin()
+            result = await sb.rpc("submit_exam", {
+                "p_exam_id": exam_id,
+                "p_student_id": student_id,
+                "p_answers": answers,
+                "p_file_url": submission.file_url,
+                "p_idempotency_key": idempotency_key,
+            }).execute()
+            row = (result.data or [{}])[0]
+
+            if not row.get("exam_status"):
+                raise HTTPException(status_code=404, detail="Exam not found")
+            if not row.get("submission_id"):
+                raise HTTPException(status_code=400, detail="This exam is not accepting submissions")
+            submission_id, created, stored_key = row["submission_id"], row["created"], row.get("idempotency_key")
+
+        # A conflicting row only counts as success if it came from the same request
+        if not created and not (idempotency_key and stored_key == idempotency_key):
+            raise HTTPException(status_code=400, detail="Already submitted this exam")
+
+        if idempotency_key:
+            _submission_keys.set((student_id, exam_id, idempotency_key), submission_id)
 
-        result = sb.table("submissions").insert(sub_data).execute()
+        await draft_store.discard(exam_id, student_id)
 
-        return {"message": "Exam submitted successfully", "submission_id": result.data[0]["id"] if result.data else None}
+        return {"message": "Exam submitted successfully", "submission_id": submission_id}
 
     except HTTPException:
         raise
@@ -175,20 +299,31 @@ async def submit_exam(
 async def get_results(current_user: dict = Depends(require_role("student"))):
     """Get all published results for the current student."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
         student_id = current_user["id"]
 
-        results = sb.table("results").select("*").eq("student_id", student_id).eq("published", True).order("evaluated_at", desc=True).execute()
-
-        result_list = results.data or []
+        results = await (
+            sb.table("results")
+            .select("*, exam:exams(title, subject, total_marks, scheduled_at)")
+            .eq("student_id", student_id)
+            .eq("published", True)
+            .order("evaluated_at", desc=True)
+            .execute()
+        )
 
-        # Enrich with exam info
-        for r in result_list:
-            exam = sb.table("exams").select("title, subject, total_marks, scheduled_at").eq("id", r["exam_id"]).single().execute()
-            if exam.data:
-                r["exam"] = exam.data
+        result_list = _without_missing_exam(results.data or [])
 
         return result_list
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/performance", response_model=dict)
+async def get_performance_summary(current_user: dict = Depends(require_role("student"))):
+    """Overall and per-subject performance across published results."""
+    try:
+        performance = await get_performance(current_user["id"])
+        return performance or {"student_id": current_user["id"], "results_count": 0, "average_percentage": None, "subjects": {}}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -3,14 +3,28 @@ Teacher Router
 Exam CRUD, question management, submission review, result publishing
 """
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Response
+from fastapi.responses import StreamingResponse
 from app.models.schemas import (
     ExamCreate, ExamUpdate, ExamResponse, QuestionCreate,
-    EvaluateSubmission, TeacherDashboard
+    EvaluateSubmission, EvaluateBatchItem, GradingScaleUpdate, TeacherDashboard
 )
-from app.services.supabase import get_supabase_admin
+from app.services.supabase import get_async_supabase_admin
+from app.services.exam_paper import invalidate_exam_paper, invalidate_exam
+from app.services.exam_scheduler import exam_scheduler
+from app.services.exports import ResultExport, MEDIA_TYPES, stream_export, xlsx_available
+from app.services.analytics import get_exam_analytics, invalidate_analytics
+from app.services.performance import publish_exam_results, refresh_performance
+from app.services.grading import (
+    AnswerKey, GradingScale, get_scale, invalidate_scales, percentages_for, regrade_exams
+)
+from app.services.pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, keyset_filter, iter_pages, IN_FILTER_CHUNK
 from app.middleware.auth import require_role
-from typing import List
+from datetime import datetime, timezone
+from typing import List, Optional
+import numpy as np
+import asyncio
+import time
 
 router = APIRouter()
 
@@ -19,35 +33,25 @@ router = APIRouter()
 async def teacher_dashboard(current_user: dict = Depends(require_role("teacher"))):
     """Get teacher dashboard statistics."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
         teacher_id = current_user["id"]
 
-        # Teacher's exams
-        exams = sb.table("exams").select("*").eq("teacher_id", teacher_id).execute()
+        # Teacher's exams + submission aggregates, fetched concurrently
+        exams, stats = await asyncio.gather(
+            sb.table("exams").select("*").eq("teacher_id", teacher_id).order("created_at", desc=True).execute(),
+            sb.rpc("teacher_submission_stats", {"p_teacher_id": teacher_id}).execute(),
+        )
         exam_list = exams.data or []
-        exam_ids = [e["id"] for e in exam_list]
+        totals = (stats.data or [{}])[0]
 
         active_exams = sum(1 for e in exam_list if e["status"] in ("scheduled", "active"))
 
-        # Submissions for teacher's exams
-        total_submissions = 0
-        pending_evaluations = 0
-        if exam_ids:
-            for eid in exam_ids:
-                subs = sb.table("submissions").select("id, status").eq("exam_id", eid).execute()
-                sub_list = subs.data or []
-                total_submissions += len(sub_list)
-                pending_evaluations += sum(1 for s in sub_list if s["status"] == "submitted")
-
-        # Recent exams
-        recent = sb.table("exams").select("*").eq("teacher_id", teacher_id).order("created_at", desc=True).limit(5).execute()
-
         return TeacherDashboard(
             total_exams=len(exam_list),
             active_exams=active_exams,
-            total_submissions=total_submissions,
-            pending_evaluations=pending_evaluations,
-            recent_exams=recent.data or []
+            total_submissions=totals.get("total_submissions") or 0,
+            pending_evaluations=totals.get("pending_evaluations") or 0,
+            recent_exams=exam_list[:5]
         )
 
     except Exception as e:
@@ -60,8 +64,8 @@ async def teacher_dashboard(current_user: dict = Depends(require_role("teacher")
 async def list_exams(current_user: dict = Depends(require_role("teacher"))):
     """List all exams created by this teacher."""
     try:
-        sb = get_supabase_admin()
-        result = sb.table("exams").select("*").eq("teacher_id", current_user["id"]).order("created_at", desc=True).execute()
+        sb = await get_async_supabase_admin()
+        result = await sb.table("exams").select("*").eq("teacher_id", current_user["id"]).order("created_at", desc=True).execute()
         return result.data or []
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -71,13 +75,13 @@ async def list_exams(current_user: dict = Depends(require_role("teacher"))):
 async def create_exam(exam: ExamCreate, current_user: dict = Depends(require_role("teacher"))):
     """Create a new exam."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
         exam_data = {
             **exam.model_dump(),
             "teacher_id": current_user["id"],
             "status": "draft"
         }
-        result = sb.table("exams").insert(exam_data).execute()
+        result = await sb.table("exams").insert(exam_data).execute()
         return {"message": "Exam created", "exam": result.data[0] if result.data else {}}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to create exam: {str(e)}")
@@ -87,8 +91,8 @@ async def create_exam(exam: ExamCreate, current_user: dict = Depends(require_rol
 async def get_exam(exam_id: str, current_user: dict = Depends(require_role("teacher"))):
     """Get exam details."""
     try:
-        sb = get_supabase_admin()
-        result = sb.table("exams").select("*").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
+        sb = await get_async_supabase_admin()
+        result = await sb.table("exams").select("*").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
         if not result.data:
             raise HTTPException(status_code=404, detail="Exam not found")
         return result.data
@@ -106,7 +110,7 @@ async def update_exam(
 ):
     """Update an exam."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
         update_data = {k: v for k, v in update.model_dump().items() if v is not None}
         if "status" in update_data:
             update_data["status"] = update_data["status"].value if hasattr(update_data["status"], "value") else update_data["status"]
@@ -114,8 +118,18 @@ async def update_exam(
         if not update_data:
             raise HTTPException(status_code=400, detail="No fields to update")
 
-        sb.table("exams").update(update_data).eq("id", exam_id).eq("teacher_id", current_user["id"]).execute()
-        return {"message": "Exam updated"}
+        updated = await sb.table("exams").update(update_data).eq("id", exam_id).eq("teacher_id", current_user["id"]).execute()
+        await invalidate_exam_paper(exam_id)
+        for row in updated.data or []:
+            await exam_scheduler.track(row)
+
+        # Stored percentages/grades depend on total_marks
+        regraded = 0
+        if "total_marks" in update_data and updated.data:
+            regraded = await regrade_exams([exam_id])
+            await invalidate_analytics(exam_id)
+
+        return {"message": "Exam updated", "results_regraded": regraded}
     except HTTPException:
         raise
     except Exception as e:
@@ -126,8 +140,10 @@ async def update_exam(
 async def delete_exam(exam_id: str, current_user: dict = Depends(require_role("teacher"))):
     """Delete an exam."""
     try:
-        sb = get_supabase_admin()
-        sb.table("exams").delete().eq("id", exam_id).eq("teacher_id", current_user["id"]).execute()
+        sb = await get_async_supabase_admin()
+        await sb.table("exams").delete().eq("id", exam_id).eq("teacher_id", current_user["id"]).execute()
+        await invalidate_exam(exam_id)
+        exam_scheduler.forget(exam_id)
         return {"message": "Exam deleted"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -143,10 +159,10 @@ async def add_questions(
 ):
     """Add questions to an exam (batch)."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
 
         # Verify exam ownership
-        exam = sb.table("exams").select("id").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
+        exam = await sb.table("exams").select("id").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
         if not exam.data:
             raise HTTPException(status_code=404, detail="Exam not found")
 
@@ -160,7 +176,8 @@ async def add_questions(
                 qd["options"] = json.dumps(qd["options"])
             question_data.append(qd)
 
-        result = sb.table("questions").insert(question_data).execute()
+        result = await sb.table("questions").insert(question_data).execute()
+        await invalidate_exam_paper(exam_id)
         return {"message": f"{len(questions)} questions added", "questions": result.data or []}
 
     except HTTPException:
@@ -173,8 +190,8 @@ async def add_questions(
 async def get_questions(exam_id: str, current_user: dict = Depends(require_role("teacher"))):
     """Get all questions for an exam."""
     try:
-        sb = get_supabase_admin()
-        result = sb.table("questions").select("*").eq("exam_id", exam_id).order("order_num").execute()
+        sb = await get_async_supabase_admin()
+        result = await sb.table("questions").select("*").eq("exam_id", exam_id).order("order_num").execute()
         return result.data or []
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -187,10 +204,10 @@ async def publish_exam(
     exam_id: str,
     current_user: dict = Depends(require_role("teacher"))
 ):
-    """Schedule/activate an exam (change status from draft → scheduled)."""
+    """Schedule an exam (draft → scheduled); it then opens and closes on its own schedule."""
     try:
-        sb = get_supabase_admin()
-        exam = sb.table("exams").select("*").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
+        sb = await get_async_supabase_admin()
+        exam = await sb.table("exams").select("*").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
 
         if not exam.data:
             raise HTTPException(status_code=404, detail="Exam not found")
@@ -198,7 +215,10 @@ async def publish_exam(
         if exam.data["status"] not in ("draft", "scheduled"):
             raise HTTPException(status_code=400, detail="Can only publish draft or scheduled exams")
 
-        sb.table("exams").update({"status": "scheduled"}).eq("id", exam_id).execute()
+        updated = await sb.table("exams").update({"status": "scheduled"}).eq("id", exam_id).execute()
+        await invalidate_exam_paper(exam_id)
+        for row in updated.data or []:
+            await exam_scheduler.track(row)
         return {"message": "Exam scheduled successfully"}
 
     except HTTPException:
@@ -207,27 +227,86 @@ async def publish_exam(
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.put("/exams/{exam_id}/grading-scale", response_model=dict)
+async def set_exam_grading_scale(
+    exam_id: str,
+    scale: GradingScaleUpdate,
+    current_user: dict = Depends(require_role("teacher"))
+):
+    """Set an exam-specific grading scale and regrade the exam's results."""
+    try:
+        sb = await get_async_supabase_admin()
+
+        try:
+            GradingScale((b.min_percentage, b.grade) for b in scale.bands)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        exam = await sb.table("exams").select("id").eq("id", exam_id).eq("teacher_id", current_user["id"]).maybe_single().execute()
+        if not exam or not exam.data:
+            raise HTTPException(status_code=404, detail="Exam not found")
+
+        await sb.table("grading_scales").upsert(
+            {"exam_id": exam_id, "bands": [b.model_dump() for b in scale.bands]},
+            on_conflict="exam_id",
+        ).execute()
+        await invalidate_scales()
+
+        regraded = await regrade_exams([exam_id])
+        await invalidate_analytics(exam_id)
+        return {"message": "Grading scale updated", "results_regraded": regraded}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 # ──── Submissions / Evaluation ────
 
 @router.get("/exams/{exam_id}/submissions", response_model=list)
-async def get_submissions(exam_id: str, current_user: dict = Depends(require_role("teacher"))):
-    """View all submissions for an exam."""
+async def get_submissions(
+    exam_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size (omit to return all)"),
+    cursor: Optional[str] = Query(None, description=f"Value of the {NEXT_CURSOR_HEADER} header from the previous page"),
+    current_user: dict = Depends(require_role("teacher"))
+):
+    """View submissions for an exam, newest first, with student info embedded."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
 
         # Verify exam ownership
-        exam = sb.table("exams").select("id").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
+        exam = await sb.table("exams").select("id").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
         if not exam.data:
             raise HTTPException(status_code=404, detail="Exam not found")
 
-        subs = sb.table("submissions").select("*").eq("exam_id", exam_id).order("submitted_at", desc=True).execute()
-
-        # Enrich with student info
+        # Student info comes from the embedded profiles resource (single round trip)
+        query = (
+            sb.table("submissions")
+            .select("*, student:profiles!student_id(full_name, email, reg_number)")
+            .eq("exam_id", exam_id)
+            .order("submitted_at", desc=True)
+            .order("id", desc=True)
+        )
+        if cursor:
+            try:
+                submitted_at, last_id = decode_cursor(cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            query = query.or_(keyset_filter("submitted_at", submitted_at, last_id))
+        if limit:
+            query = query.limit(limit)
+
+        subs = await query.execute()
         submissions = subs.data or []
         for sub in submissions:
-            student = sb.table("profiles").select("full_name, email, reg_number").eq("id", sub["student_id"]).single().execute()
-            if student.data:
-                sub["student"] = student.data
+            if sub.get("student") is None:
+                sub.pop("student", None)
+
+        if limit and len(submissions) == limit:
+            last = submissions[-1]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last["submitted_at"], last["id"])
 
         return submissions
 
@@ -245,15 +324,15 @@ async def evaluate_submission(
 ):
     """Grade a student submission."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
 
         # Get submission
-        sub = sb.table("submissions").select("*").eq("id", submission_id).single().execute()
+        sub = await sb.table("submissions").select("*").eq("id", submission_id).single().execute()
         if not sub.data:
             raise HTTPException(status_code=404, detail="Submission not found")
 
         # Get exam to verify ownership and total marks
-        exam = sb.table("exams").select("*").eq("id", sub.data["exam_id"]).eq("teacher_id", current_user["id"]).single().execute()
+        exam = await sb.table("exams").select("*").eq("id", sub.data["exam_id"]).eq("teacher_id", current_user["id"]).single().execute()
         if not exam.data:
             raise HTTPException(status_code=403, detail="Not authorized to evaluate this submission")
 
@@ -263,21 +342,8 @@ async def evaluate_submission(
 
         percentage = round((evaluation.marks_obtained / total_marks) * 100, 2)
 
-        # Determine grade
-        if percentage >= 90:
-            grade = "A+"
-        elif percentage >= 80:
-            grade = "A"
-        elif percentage >= 70:
-            grade = "B+"
-        elif percentage >= 60:
-            grade = "B"
-        elif percentage >= 50:
-            grade = "C"
-        elif percentage >= 40:
-            grade = "D"
-        else:
-            grade = "F"
+        scale = await get_scale(sub.data["exam_id"], current_user.get("department"), fresh=True)
+        grade = scale.grade(percentage)
 
         # Insert/update result
         result_data = {
@@ -293,15 +359,14 @@ async def evaluate_submission(
             "published": False
         }
 
-        # Check if result already exists
-        existing = sb.table("results").select("id").eq("submission_id", submission_id).execute()
-        if existing.data:
-            sb.table("results").update(result_data).eq("submission_id", submission_id).execute()
-        else:
-            sb.table("results").insert(result_data).execute()
+        await sb.table("results").upsert(result_data, on_conflict="submission_id").execute()
 
         # Update submission status
-        sb.table("submissions").update({"status": "evaluated"}).eq("id", submission_id).execute()
+        await sb.table("submissions").update({"status": "evaluated"}).eq("id", submission_id).execute()
+        await invalidate_analytics(sub.data["exam_id"])
+        # Re-evaluating a published result unpublishes it
+        if exam.data["status"] == "results_published":
+            await refresh_performance([sub.data["student_id"]])
 
         return {"message": "Submission evaluated", "grade": grade, "percentage": percentage}
 
@@ -311,24 +376,248 @@ async def evaluate_submission(
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/exams/{exam_id}/evaluate-batch", response_model=dict)
+async def evaluate_batch(
+    exam_id: str,
+    evaluations: List[EvaluateBatchItem],
+    current_user: dict = Depends(require_role("teacher"))
+):
+    """Grade many submissions of one exam at once. Invalid entries are reported, not fatal."""
+    try:
+        sb = await get_async_supabase_admin()
+        submission_ids = list({e.submission_id for e in evaluations})
+
+        # Ownership check and submission lookup in parallel (one round trip)
+        exam, subs = await asyncio.gather(
+            sb.table("exams").select("id, total_marks, status").eq("id", exam_id).eq("teacher_id", current_user["id"]).maybe_single().execute(),
+            sb.table("submissions").select("id, student_id").eq("exam_id", exam_id).in_("id", submission_ids).execute(),
+        )
+        if not exam or not exam.data:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        total_marks = exam.data["total_marks"]
+        students = {s["id"]: s["student_id"] for s in (subs.data or [])}
+
+        errors = []
+        accepted = {}
+        for item in evaluations:
+            if item.submission_id not in students:
+                errors.append({"submission_id": item.submission_id, "error": "Submission not found for this exam"})
+            elif item.marks_obtained > total_marks:
+                errors.append({"submission_id": item.submission_id, "error": f"Marks cannot exceed total marks ({total_marks})"})
+            else:
+                accepted[item.submission_id] = item  # last entry wins for duplicates
+
+        if not accepted:
+            return {"message": "No submissions evaluated", "evaluated": 0, "results": [], "errors": errors}
+
+        items = list(accepted.values())
+        scale = await get_scale(exam_id, current_user.get("department"), fresh=True)
+        percentages = percentages_for(np.array([i.marks_obtained for i in items], dtype=float), total_marks)
+        grades = scale.grade_many(percentages)
+
+        evaluated_at = datetime.now(timezone.utc).isoformat()
+        rows = [
+            {
+                "exam_id": exam_id,
+                "student_id": students[item.submission_id],
+                "submission_id": item.submission_id,
+                "marks_obtained": item.marks_obtained,
+                "total_marks": total_marks,
+                "percentage": pct,
+                "grade": grade,
+                "remarks": item.remarks,
+                "evaluated_by": current_user["id"],
+                "published": False,
+                "evaluated_at": evaluated_at,
+            }
+            for item, pct, grade in zip(items, percentages.tolist(), grades)
+        ]
+
+        await sb.table("results").upsert(rows, on_conflict="submission_id", returning="minimal").execute()
+        await sb.table("submissions").update({"status": "evaluated"}).in_("id", list(accepted)).execute()
+        await invalidate_analytics(exam_id)
+        if exam.data["status"] == "results_published":
+            await refresh_performance(r["student_id"] for r in rows)
+
+        return {
+            "message": f"{len(rows)} submissions evaluated",
+            "evaluated": len(rows),
+            "results": [
+                {"submission_id": r["submission_id"], "grade": r["grade"], "percentage": r["percentage"]}
+                for r in rows
+            ],
+            "errors": errors,
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/exams/{exam_id}/auto-grade", response_model=dict)
+async def auto_grade_exam(
+    exam_id: str,
+    overwrite: bool = Query(False, description="Also regrade submissions that were already evaluated"),
+    current_user: dict = Depends(require_role("teacher"))
+):
+    """
+    Score MCQ answers for every submission of an exam in one batch.
+    Text / file questions are left for manual marking.
+    """
+    try:
+        sb = await get_async_supabase_admin()
+
+        exam = await sb.table("exams").select("*").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
+        if not exam.data:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        total_marks = exam.data["total_marks"]
+
+        def subs_query():
+            query = sb.table("submissions").select("id, student_id, answers").eq("exam_id", exam_id)
+            return query if overwrite else query.eq("status", "submitted")
+
+        questions = await sb.table("questions").select("id, question_type, options, correct_answer, marks").eq("exam_id", exam_id).execute()
+        key = AnswerKey(questions.data or [])
+        scale = await get_scale(exam_id, current_user.get("department"), fresh=True)
+        if not key.question_ids:
+            raise HTTPException(status_code=400, detail="This exam has no auto-gradable MCQ questions")
+
+        if key.fully_automatic:
+            remarks = "Auto-graded (MCQ)"
+        else:
+            remarks = f"MCQ auto-graded; {len(key.manual_question_ids)} question(s) pending manual marking"
+        evaluated_at = datetime.now(timezone.utc).isoformat()
+
+        # Score and write one keyset page of submissions at a time
+        graded = 0
+        cpu_seconds = 0.0
+        students = set()
+        async for submissions in iter_pages(subs_query):
+            started = time.process_time()
+            matrix = key.encode([s["answers"] for s in submissions])
+            marks = np.minimum(key.score(matrix), total_marks)
+            percentages = percentages_for(marks, total_marks)
+            grades = scale.grade_many(percentages)
+            cpu_seconds += time.process_time() - started
+
+            rows = [
+                {
+                    "exam_id": exam_id,
+                    "student_id": sub["student_id"],
+                    "submission_id": sub["id"],
+                    "marks_obtained": int(m),
+                    "total_marks": total_marks,
+                    "percentage": float(p),
+                    "grade": g,
+                    "remarks": remarks,
+                    "evaluated_by": current_user["id"],
+                    "published": False,
+                    "evaluated_at": evaluated_at,
+                }
+                for sub, m, p, g in zip(submissions, marks.tolist(), percentages.tolist(), grades)
+            ]
+            await sb.table("results").upsert(rows, on_conflict="submission_id", returning="minimal").execute()
+
+            # Only fully machine-gradable scripts are complete; others still need manual marks.
+            # Updated by id: rows submitted into the page's id range meanwhile have no result yet.
+            if key.fully_automatic:
+                ids = [sub["id"] for sub in submissions]
+
+                def mark_evaluated(chunk):
+                    update = sb.table("submissions").update({"status": "evaluated"}, returning="minimal").in_("id", chunk)
+                    return (update if overwrite else update.eq("status", "submitted")).execute()
+
+                await asyncio.gather(*(
+                    mark_evaluated(ids[i:i + IN_FILTER_CHUNK]) for i in range(0, len(ids), IN_FILTER_CHUNK)
+                ))
+            graded += len(rows)
+            students.update(r["student_id"] for r in rows)
+
+        if not graded:
+            return {"message": "No submissions to grade", "graded": 0}
+
+        await invalidate_analytics(exam_id)
+        if exam.data["status"] == "results_published":
+            await refresh_performance(students)
+
+        return {
+            "message": f"{graded} submissions auto-graded",
+            "graded": graded,
+            "mcq_questions": len(key.question_ids),
+            "manual_questions": len(key.manual_question_ids),
+            "fully_automatic": key.fully_automatic,
+            "cpu_ms": round(cpu_seconds * 1000, 2),
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/exams/{exam_id}/analytics", response_model=dict)
+async def exam_analytics(exam_id: str, current_user: dict = Depends(require_role("teacher"))):
+    """Score statistics, ranks and MCQ item analysis for an exam."""
+    try:
+        sb = await get_async_supabase_admin()
+        exam = await sb.table("exams").select("id, total_marks").eq("id", exam_id).eq("teacher_id", current_user["id"]).maybe_single().execute()
+        if not exam or not exam.data:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        return await get_exam_analytics(exam.data, current_user.get("department"))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/exams/{exam_id}/results/export")
+async def export_exam_results(
+    exam_id: str,
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    current_user: dict = Depends(require_role("teacher"))
+):
+    """Download the results of an exam as CSV or XLSX (streamed)."""
+    try:
+        sb = await get_async_supabase_admin()
+        exam = await sb.table("exams").select("id, title").eq("id", exam_id).eq("teacher_id", current_user["id"]).maybe_single().execute()
+        if not exam or not exam.data:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        if format == "xlsx" and not xlsx_available():
+            raise HTTPException(status_code=400, detail="XLSX export is not available on this server (openpyxl not installed)")
+
+        body = await stream_export(ResultExport(exam_id=exam_id), format)
+        filename = f"results-{exam_id}.{format}"
+        return StreamingResponse(
+            body,
+            media_type=MEDIA_TYPES[format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/exams/{exam_id}/publish-results", response_model=dict)
 async def publish_results(exam_id: str, current_user: dict = Depends(require_role("teacher"))):
     """Publish all results for an exam."""
     try:
-        sb = get_supabase_admin()
+        sb = await get_async_supabase_admin()
 
         # Verify ownership
-        exam = sb.table("exams").select("id").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
+        exam = await sb.table("exams").select("id").eq("id", exam_id).eq("teacher_id", current_user["id"]).single().execute()
         if not exam.data:
             raise HTTPException(status_code=404, detail="Exam not found")
 
-        # Publish all results
-        sb.table("results").update({"published": True}).eq("exam_id", exam_id).execute()
-
-        # Update exam status
-        sb.table("exams").update({"status": "results_published"}).eq("id", exam_id).execute()
+        # Publish results, set the exam status and update student aggregates (one transaction)
+        students_updated = await publish_exam_results(exam_id)
+        await invalidate_exam(exam_id)
+        exam_scheduler.forget(exam_id)
 
-        return {"message": "Results published successfully"}
+        return {"message": "Results published successfully", "students_updated": students_updated}
 
     except HTTPException:
         raise
@@ -0,0 +1,181 @@
+"""
+Exam Analytics
+Score distribution, percentiles, grade histogram and ranks from an exam's
+results, plus MCQ item analysis (difficulty / discrimination) from the
+submitted answers. Computed with array operations and cached per exam.
+"""
+
+import os
+import asyncio
+import numpy as np
+from datetime import datetime, timezone
+from typing import Optional
+from app.services.supabase import get_async_supabase_admin
+from app.services.pagination import fetch_all
+from app.services.cache import Cache, invalidate_tags
+from app.services.exam_paper import exam_tag
+from app.services.grading import AnswerKey, get_scale, percentages_for, parse_options, UNANSWERED
+
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "600"))
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "256"))
+
+PERCENTILES = (10, 25, 50, 75, 90)
+# Share of students in the upper / lower groups for the discrimination index
+DISCRIMINATION_GROUP = 0.27
+
+analytics_cache = Cache("analytics", ttl=ANALYTICS_CACHE_TTL, maxsize=ANALYTICS_CACHE_SIZE)
+
+
+def results_tag(exam_id: str) -> str:
+    """Tag of entries derived from an exam's results (not its paper)."""
+    return f"exam_results:{exam_id}"
+
+
+def _round(values, digits: int = 2):
+    return np.round(values, digits).tolist()
+
+
+def competition_ranks(marks: np.ndarray) -> np.ndarray:
+    """Rank by marks, highest first; ties share a rank ("1224" ranking)."""
+    ascending = np.sort(marks)
+    return len(marks) - np.searchsorted(ascending, marks, side="right") + 1
+
+
+def score_summary(marks: np.ndarray, total_marks: int, grades: list, scale) -> dict:
+    """Distribution statistics for one exam's marks."""
+    percentages = percentages_for(marks, total_marks)
+    counts, edges = np.histogram(percentages, bins=np.linspace(0, 100, 11))
+
+    grade_values, grade_counts = np.unique(np.array(grades, dtype=object).astype(str), return_counts=True)
+    by_grade = dict(zip(grade_values.tolist(), grade_counts.tolist()))
+    ordered = list(reversed(scale.grades)) + sorted(set(by_grade) - set(scale.grades))
+
+    return {
+        "count": int(marks.size),
+        "mean": round(float(marks.mean()), 2),
+        "median": round(float(np.median(marks)), 2),
+        "std_dev": round(float(marks.std()), 2),
+        "min": int(marks.min()),
+        "max": int(marks.max()),
+        "mean_percentage": round(float(percentages.mean()), 2),
+        "percentiles": dict(zip((f"p{p}" for p in PERCENTILES), _round(np.percentile(marks, PERCENTILES)))),
+        "pass_rate": round(float((percentages >= scale.thresholds[1]).mean()) * 100, 2) if len(scale.thresholds) > 1 else None,
+        "histogram": [
+            {"from": int(lo), "to": int(hi), "count": int(c)}
+            for lo, hi, c in zip(edges[:-1], edges[1:], counts)
+        ],
+        "grades": [{"grade": g, "count": int(by_grade.get(g, 0))} for g in ordered],
+    }
+
+
+def item_analysis(key: AnswerKey, answer_sets: list, questions: list) -> list:
+    """
+    Per-question difficulty (share answering correctly), discrimination index
+    (upper minus lower 27% by MCQ score), omission rate and option counts.
+    """
+    matrix = key.encode(answer_sets)
+    n = matrix.shape[0]
+    correct = key.correct(matrix)
+    difficulty = correct.mean(axis=0)
+    omitted = (matrix == UNANSWERED).mean(axis=0)
+
+    group = max(1, int(round(n * DISCRIMINATION_GROUP)))
+    if n >= 2:
+        order = np.argsort(key.score(matrix), kind="stable")
+        discrimination = correct[order[-group:]].mean(axis=0) - correct[order[:group]].mean(axis=0)
+    else:
+        discrimination = np.full(len(key.question_ids), np.nan)
+
+    # Option counts for all questions in one bincount: (question, option) → flat bucket
+    options_per_question = [len(parse_options(q.get("options"))) for q in questions]
+    width = max(options_per_question, default=0) or 1
+    columns = np.broadcast_to(np.arange(matrix.shape[1]), matrix.shape)
+    answered = matrix != UNANSWERED
+    flat = np.bincount((columns[answered] * width + matrix[answered]).astype(np.int64), minlength=matrix.shape[1] * width)
+    option_counts = flat.reshape(matrix.shape[1], width)
+
+    return [
+        {
+            "question_id": qid,
+            "difficulty": round(float(difficulty[j]), 3),
+            "discrimination": None if np.isnan(discrimination[j]) else round(float(discrimination[j]), 3),
+            "omitted_rate": round(float(omitted[j]), 3),
+            "correct_option": int(key.key[j]),
+            "option_counts": option_counts[j, :options_per_question[j]].tolist(),
+        }
+        for j, qid in enumerate(key.question_ids)
+    ]
+
+
+async def _build_analytics(exam: dict, department: Optional[str]) -> dict:
+    exam_id = exam["id"]
+    sb = await get_async_supabase_admin()
+    # Results and answers are read in full, page by page, in id order
+    rows, questions, submissions = await asyncio.gather(
+        fetch_all(lambda: sb.table("results")
+                  .select("id, student_id, marks_obtained, grade, published, student:profiles!student_id(full_name, reg_number)")
+                  .eq("exam_id", exam_id)),
+        sb.table("questions").select("id, question_type, options, correct_answer, marks").eq("exam_id", exam_id).order("order_num").execute(),
+        fetch_all(lambda: sb.table("submissions").select("id, answers").eq("exam_id", exam_id)),
+    )
+    analytics = {
+        "exam_id": exam_id,
+        "total_marks": exam["total_marks"],
+        "submissions": len(submissions),
+        "evaluated": len(rows),
+        "published": sum(1 for r in rows if r.get("published")),
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "summary": None,
+        "students": [],
+        "items": [],
+    }
+
+    if rows:
+        scale = await get_scale(exam_id, department)
+        marks = np.array([r["marks_obtained"] for r in rows], dtype=float)
+        grades = [r.get("grade") or "" for r in rows]
+        analytics["summary"] = score_summary(marks, exam["total_marks"], grades, scale)
+
+        ranks = competition_ranks(marks)
+        percentile_ranks = (np.searchsorted(np.sort(marks), marks, side="right") / marks.size) * 100
+        percentages = percentages_for(marks, exam["total_marks"])
+        order = np.argsort(ranks, kind="stable")
+        analytics["students"] = [
+            {
+                "student_id": rows[i]["student_id"],
+                "full_name": (rows[i].get("student") or {}).get("full_name"),
+                "reg_number": (rows[i].get("student") or {}).get("reg_number"),
+                "marks_obtained": rows[i]["marks_obtained"],
+                "percentage": float(percentages[i]),
+                "grade": rows[i].get("grade"),
+                "rank": int(ranks[i]),
+                "percentile_rank": round(float(percentile_ranks[i]), 1),
+            }
+            for i in order.tolist()
+        ]
+
+    key = AnswerKey(questions.data or [])
+    if key.question_ids and submissions:
+        by_id = {q["id"]: q for q in (questions.data or [])}
+        analytics["items"] = item_analysis(key, [s.get("answers") for s in submissions], [by_id[q] for q in key.question_ids])
+
+    return analytics
+
+
+async def get_exam_analytics(exam: dict, department: Optional[str] = None) -> dict:
+    """Cached analytics for an exam row (needs id and total_marks)."""
+    analytics = await analytics_cache.get(exam["id"])
+    if analytics is None:
+        tags = [exam_tag(exam["id"]), results_tag(exam["id"])]
+        versions = await analytics_cache.versions(tags)
+        analytics = await _build_analytics(exam, department)
+        await analytics_cache.set(exam["id"], analytics, tags=tags, versions=versions)
+    return analytics
+
+
+async def invalidate_analytics(exam_id: Optional[str] = None) -> None:
+    """Drop cached analytics for one exam, or for all exams."""
+    if exam_id is None:
+        await analytics_cache.clear()
+    else:
+        await invalidate_tags(results_tag(exam_id))
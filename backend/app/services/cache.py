@@ -0,0 +1,542 @@
+"""
+Caches
+Bounded in-process LRU cache with per-entry TTL, and a namespaced async cache
+with tag-based invalidation on a pluggable backend: in-process (default) or a
+Redis-protocol server shared by every worker (CACHE_BACKEND=redis, REDIS_URL).
+
+Invalidating a tag also bumps its generation. A loader snapshots versions()
+before reading the database and passes them to set(), which skips storing if
+an invalidation happened in between, so data read before a change is never
+cached after it.
+"""
+
+import os
+import time
+import zlib
+import asyncio
+import datetime
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed for the Redis backend
+    msgpack = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional: only needed for the Redis backend
+    aioredis = None
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "examconnect")
+# Tag sets outlive their entries; they are dropped on invalidation or after this long
+CACHE_TAG_TTL = int(os.getenv("CACHE_TAG_TTL", "86400"))
+# Serialized values above this size are zlib-compressed
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+# Tag generations are kept this long after an invalidation (longer than any load takes)
+CACHE_GENERATION_WINDOW = int(os.getenv("CACHE_GENERATION_WINDOW", "600"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, on_remove: Optional[Callable[[Any], None]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_remove = on_remove  # called with each key that expires or is evicted
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _removed(self, keys: list) -> None:
+        # Called outside the lock so the callback may take its own locks
+        if self.on_remove:
+            for key in keys:
+                self.on_remove(key)
+
+    def get(self, key, default=None) -> Optional[Any]:
+        expired = []
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                expired.append(key)
+                value = default
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        self._removed(expired)
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        evicted = []
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False)[0])
+                self.evictions += 1
+        self._removed(evicted)
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+# ──── Serialization ────
+
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+
+def _encode_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    """msgpack-encode a JSON-like value (bytes kept as-is), compressing large payloads."""
+    packed = msgpack.packb(value, use_bin_type=True, default=_encode_default)
+    if len(packed) >= CACHE_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(packed, 1)
+        if len(compressed) < len(packed):
+            return _ZLIB + compressed
+    return _RAW + packed
+
+
+def loads(data: bytes) -> Any:
+    body = data[1:]
+    if data[:1] == _ZLIB:
+        body = zlib.decompress(body)
+    return msgpack.unpackb(body, raw=False)
+
+
+def _key_str(key: Hashable) -> str:
+    return ":".join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+
+# ──── Backends ────
+
+class MemoryBackend:
+    """Per-process store: one LRU per namespace plus a tag → keys index. Values are kept as objects."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._stores: Dict[str, TTLCache] = {}
+        self._tags: Dict[str, Set[Tuple[str, Hashable]]] = {}
+        self._key_tags: Dict[Tuple[str, Hashable], Tuple[str, ...]] = {}
+        # tag → (generation, bumped at); generations come from one counter, so they never repeat
+        self._generations: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._generation_counter = 0
+        self._lock = threading.RLock()
+
+    def register(self, namespace: str, maxsize: int, ttl: float) -> None:
+        self._stores[namespace] = TTLCache(maxsize, ttl, on_remove=lambda key: self._untag(namespace, key))
+
+    def _untag(self, namespace: str, key: Hashable) -> None:
+        with self._lock:
+            for tag in self._key_tags.pop((namespace, key), ()):
+                keys = self._tags.get(tag)
+                if keys is not None:
+                    keys.discard((namespace, key))
+                    if not keys:
+                        del self._tags[tag]
+
+    async def get_many(self, namespace: str, keys: List[Hashable]) -> list:
+        store = self._stores[namespace]
+        return [store.get(key, _MISSING) for key in keys]
+
+    def _bump(self, tags: Iterable[str]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for tag in tags:
+                self._generation_counter += 1
+                self._generations[tag] = (self._generation_counter, now)
+                self._generations.move_to_end(tag)
+            while self._generations and next(iter(self._generations.values()))[1] < now - CACHE_GENERATION_WINDOW:
+                self._generations.popitem(last=False)
+
+    async def versions(self, tags: List[str]) -> Dict[str, int]:
+        with self._lock:
+            return {tag: self._generations.get(tag, (0, 0.0))[0] for tag in tags}
+
+    async def set(
+        self, namespace: str, key: Hashable, value: Any, ttl: float, tags: Tuple[str, ...],
+        versions: Optional[Dict[str, int]] = None,
+    ) -> bool:
+        with self._lock:
+            if versions and any(self._generations.get(t, (0, 0.0))[0] != v for t, v in versions.items()):
+                return False
+            self._untag(namespace, key)
+            if tags:
+                self._key_tags[(namespace, key)] = tags
+                for tag in tags:
+                    self._tags.setdefault(tag, set()).add((namespace, key))
+            self._stores[namespace].set(key, value, ttl)
+        return True
+
+    async def delete(self, namespace: str, keys: List[Hashable]) -> None:
+        store = self._stores[namespace]
+        for key in keys:
+            store.invalidate(key)
+            self._untag(namespace, key)
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> int:
+        tags = list(tags)
+        with self._lock:
+            self._bump(tags)
+            entries = set()
+            for tag in tags:
+                entries |= self._tags.pop(tag, set())
+        for namespace, key in entries:
+            self._stores[namespace].invalidate(key)
+            self._untag(namespace, key)
+        return len(entries)
+
+    async def clear(self, namespace: str) -> None:
+        self._stores[namespace].clear()
+        with self._lock:
+            for entry in [e for e in self._key_tags if e[0] == namespace]:
+                self._untag(*entry)
+
+    def size(self, namespace: str) -> Optional[int]:
+        return len(self._stores[namespace]._data)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "tags": len(self._tags), "generations": len(self._generations)}
+
+
+# Atomically: bump each tag's generation, delete every key in its tag set, then the set.
+# KEYS: tag sets, then the matching generation keys.  ARGV: counter key, generation window (s).
+_INVALIDATE_TAGS_SCRIPT = """
+local n = #KEYS / 2
+local generation = redis.call('INCR', ARGV[1])
+local removed = 0
+for t = 1, n do
+    redis.call('SET', KEYS[n + t], generation, 'EX', ARGV[2])
+    local members = redis.call('SMEMBERS', KEYS[t])
+    for i = 1, #members, 500 do
+        removed = removed + redis.call('UNLINK', unpack(members, i, math.min(i + 499, #members)))
+    end
+    redis.call('UNLINK', KEYS[t])
+end
+return removed
+"""
+
+# Atomically store an entry and register its tags, unless a checked generation changed.
+# KEYS: entry, n tag sets, then m generation keys.
+# ARGV: value, ttl (ms), tag set ttl (s), n, then the m expected generations.
+_SET_SCRIPT = """
+local n = tonumber(ARGV[4])
+for i = 1, #KEYS - 1 - n do
+    if (redis.call('GET', KEYS[1 + n + i]) or '0') ~= ARGV[4 + i] then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+for i = 1, n do
+    redis.call('SADD', KEYS[1 + i], KEYS[1])
+    redis.call('EXPIRE', KEYS[1 + i], ARGV[3])
+end
+return 1
+"""
+
+
+class RedisBackend:
+    """
+    Shared store on a Redis-protocol server. Entries are msgpack-encoded under
+    "<prefix>:<namespace>:<key>"; each tag is a set of the entry keys carrying it.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = CACHE_KEY_PREFIX):
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._client_loop = None
+        self._invalidate_script = None
+        self._set_script = None
+
+    def register(self, namespace: str, maxsize: int, ttl: float) -> None:
+        pass  # size is bounded by the server's maxmemory policy
+
+    def _redis(self):
+        # Connections are bound to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = aioredis.from_url(self.url)
+            self._client_loop = loop
+            self._invalidate_script = self._client.register_script(_INVALIDATE_TAGS_SCRIPT)
+            self._set_script = self._client.register_script(_SET_SCRIPT)
+        return self._client
+
+    def _key(self, namespace: str, key: Hashable) -> str:
+        return f"{self.prefix}:{namespace}:{_key_str(key)}"
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.prefix}:tag:{tag}"
+
+    def _generation_key(self, tag: str) -> str:
+        return f"{self.prefix}:gen:{tag}"
+
+    async def versions(self, tags: List[str]) -> Dict[str, int]:
+        values = await self._redis().mget([self._generation_key(t) for t in tags])
+        return {tag: int(v) if v is not None else 0 for tag, v in zip(tags, values)}
+
+    async def get_many(self, namespace: str, keys: List[Hashable]) -> list:
+        values = await self._redis().mget([self._key(namespace, k) for k in keys])
+        return [_MISSING if v is None else loads(v) for v in values]
+
+    async def set(
+        self, namespace: str, key: Hashable, value: Any, ttl: float, tags: Tuple[str, ...],
+        versions: Optional[Dict[str, int]] = None,
+    ) -> bool:
+        versions = versions or {}
+        self._redis()
+        stored = await self._set_script(
+            keys=[self._key(namespace, key), *map(self._tag_key, tags), *map(self._generation_key, versions)],
+            args=[dumps(value), int(ttl * 1000), max(CACHE_TAG_TTL, int(ttl)), len(tags), *versions.values()],
+        )
+        return bool(stored)
+
+    async def delete(self, namespace: str, keys: List[Hashable]) -> None:
+        if keys:
+            await self._redis().unlink(*(self._key(namespace, k) for k in keys))
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> int:
+        tags = list(tags)
+        if not tags:
+            return 0
+        self._redis()
+        return int(await self._invalidate_script(
+            keys=[*map(self._tag_key, tags), *map(self._generation_key, tags)],
+            args=[f"{self.prefix}:gen", CACHE_GENERATION_WINDOW],
+        ))
+
+    async def clear(self, namespace: str) -> None:
+        client = self._redis()
+        batch = []
+        async for key in client.scan_iter(match=f"{self.prefix}:{namespace}:*", count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                await client.unlink(*batch)
+                batch = []
+        if batch:
+            await client.unlink(*batch)
+
+    def size(self, namespace: str) -> Optional[int]:
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "url": self.url.split("@")[-1]}
+
+
+def _create_backend():
+    if CACHE_BACKEND == "redis":
+        if aioredis is None or msgpack is None:
+            print("CACHE_BACKEND=redis needs the redis and msgpack packages; using the in-process cache")
+        else:
+            return RedisBackend()
+    elif CACHE_BACKEND != "memory":
+        print(f"Unknown CACHE_BACKEND {CACHE_BACKEND!r}; using the in-process cache")
+    return MemoryBackend()
+
+
+cache_backend = _create_backend()
+
+
+# ──── Namespaced cache ────
+
+_caches: List["Cache"] = []
+
+
+class Cache:
+    """
+    Async cache for one namespace on the configured backend. Values must be
+    JSON-like (dicts, lists, str, numbers, bytes) so any backend can hold them.
+    Backend errors are logged and treated as misses: the cache never fails a request.
+    """
+
+    def __init__(self, namespace: str, ttl: float = 60.0, maxsize: int = 1024, backend=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.backend = backend or cache_backend
+        self.backend.register(namespace, maxsize, ttl)
+        _caches.append(self)
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.stale_skips = 0
+
+    @property
+    def _namespace_tag(self) -> str:
+        # Bumped by clear(), so loads that started before it do not store
+        return f"namespace:{self.namespace}"
+
+    def _error(self, action: str, e: Exception) -> None:
+        self.errors += 1
+        print(f"Cache {self.namespace}: {action} failed: {e}")
+
+    async def get(self, key: Hashable, default=None) -> Optional[Any]:
+        return (await self.get_many([key])).get(key, default)
+
+    async def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """Cached values of the given keys; missing keys are left out."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            values = await self.backend.get_many(self.namespace, keys)
+        except Exception as e:
+            self._error("get", e)
+            values = [_MISSING] * len(keys)
+        found = {k: v for k, v in zip(keys, values) if v is not _MISSING}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def versions(self, tags: Iterable[str]) -> Optional[Dict[str, int]]:
+        """Snapshot of the tags' generations (plus this namespace's); take it before loading the value."""
+        try:
+            return await self.backend.versions([*tags, self._namespace_tag])
+        except Exception as e:
+            self._error("versions", e)
+            return None
+
+    async def set(
+        self, key: Hashable, value: Any, ttl: Optional[float] = None, tags: Iterable[str] = (),
+        versions: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """Store a value. With `versions` from versions(), nothing is stored if any of them changed since."""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        try:
+            if not await self.backend.set(self.namespace, key, value, ttl, tuple(tags), versions):
+                self.stale_skips += 1
+        except Exception as e:
+            self._error("set", e)
+
+    async def invalidate(self, *keys: Hashable) -> None:
+        """Delete entries by key. Unlike tags, this does not stop in-flight loads from storing."""
+        try:
+            await self.backend.delete(self.namespace, list(keys))
+        except Exception as e:
+            self._error("invalidate", e)
+
+    async def clear(self) -> None:
+        try:
+            await self.backend.invalidate_tags([self._namespace_tag])
+            await self.backend.clear(self.namespace)
+        except Exception as e:
+            self._error("clear", e)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "size": self.backend.size(self.namespace),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "stale_skips": self.stale_skips,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+async def invalidate_tags(*tags: str) -> int:
+    """Drop every entry carrying any of the tags, in all namespaces. Returns entries removed."""
+    try:
+        return await cache_backend.invalidate_tags(tags)
+    except Exception as e:
+        print(f"Cache: tag invalidation failed for {', '.join(tags)}: {e}")
+        return 0
+
+
+async def clear_all() -> None:
+    """Empty every namespace (e.g. after missing invalidations)."""
+    await asyncio.gather(*(cache.clear() for cache in _caches))
+
+
+def get_cache_stats() -> dict:
+    return cache_backend.stats()
+
+
+async def check_backend(backend) -> None:
+    """Round trip on a backend: store tagged entries, read them, invalidate by tag, refuse a stale store."""
+    suffix = os.urandom(4).hex()
+    namespace, tag, other_tag = f"selfcheck_{suffix}", f"selfcheck:{suffix}", f"selfcheck_other:{suffix}"
+    backend.register(namespace, 16, 60)
+
+    await backend.set(namespace, "a", {"body": b"\x00\x01", "n": 1}, 60, (tag,))
+    await backend.set(namespace, "b", "kept", 60, (other_tag,))
+    got = await backend.get_many(namespace, ["a", "b", "missing"])
+    assert got[0] == {"body": b"\x00\x01", "n": 1} and got[1] == "kept" and got[2] is _MISSING, got
+
+    versions = await backend.versions([tag])
+    assert await backend.invalidate_tags([tag]) == 1
+    got = await backend.get_many(namespace, ["a", "b"])
+    assert got[0] is _MISSING and got[1] == "kept", got
+
+    # A load that started before the invalidation must not store
+    assert not await backend.set(namespace, "a", "stale", 60, (tag,), versions)
+    assert await backend.set(namespace, "a", "fresh", 60, (tag,), await backend.versions([tag]))
+    assert (await backend.get_many(namespace, ["a"]))[0] == "fresh"
+
+    await backend.clear(namespace)
+    assert (await backend.get_many(namespace, ["b"]))[0] is _MISSING
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check a cache backend with a tag-invalidation round trip.")
+    parser.add_argument("--backend", choices=("memory", "redis"), default="redis")
+    args = parser.parse_args()
+    if args.backend == "redis" and (aioredis is None or msgpack is None):
+        raise SystemExit("The redis and msgpack packages are required for the Redis backend")
+    selected = RedisBackend() if args.backend == "redis" else MemoryBackend()
+    asyncio.run(check_backend(selected))
+    print(f"Cache backend {args.backend} OK" + (f" ({REDIS_URL.split('@')[-1]})" if args.backend == "redis" else ""))
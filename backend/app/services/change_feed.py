@@ -0,0 +1,141 @@
+"""
+Change Feed
+Listens on the Postgres "cache_invalidate" channel (filled by the
+notify_cache_change triggers) and evicts the tagged cache entries, so rows
+changed outside this API (dashboard, SQL scripts, other instances) do not
+stay cached until their TTL. Needs DATABASE_URL and psycopg2.
+"""
+
+import os
+import time
+import asyncio
+from typing import Optional, Set
+from app.services.cache import invalidate_tags, clear_all
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+except ImportError:  # optional: the feed is disabled without it
+    psycopg2 = None
+
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+CHANGE_FEED_ENABLED = os.getenv("CHANGE_FEED_ENABLED", "true").lower() in ("1", "true", "yes")
+CHANGE_FEED_CHANNEL = os.getenv("CHANGE_FEED_CHANNEL", "cache_invalidate")
+_RECONNECT_DELAY = 1.0
+_MAX_RECONNECT_DELAY = 30.0
+
+
+def change_feed_available() -> bool:
+    return CHANGE_FEED_ENABLED and bool(DATABASE_URL) and psycopg2 is not None
+
+
+class ChangeFeed:
+    """LISTEN connection driven by the event loop; notifications are applied in batches."""
+
+    def __init__(self, dsn: str = DATABASE_URL, channel: str = CHANGE_FEED_CHANNEL):
+        self.dsn = dsn
+        self.channel = channel
+        self._task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._pending: Set[str] = set()
+        self._connected = False
+        self._listened_before = False
+        self.last_notification: Optional[float] = None
+        self.metrics = {"connects": 0, "notifications": 0, "tags": 0, "evicted": 0, "errors": 0}
+
+    def _connect(self):
+        # TCP keepalives make a dead connection show up as a read error
+        conn = psycopg2.connect(self.dsn, keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+        return conn
+
+    # ──── Background task ────
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._flush_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._flush_task = None
+
+    async def _run(self) -> None:
+        delay = _RECONNECT_DELAY
+        while True:
+            conn = None
+            try:
+                conn = await asyncio.to_thread(self._connect)
+                self.metrics["connects"] += 1
+                self._connected = True
+                delay = _RECONNECT_DELAY
+                if self._listened_before:
+                    # Changes made while disconnected were not seen
+                    await clear_all()
+                self._listened_before = True
+                await self._listen(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.metrics["errors"] += 1
+                print(f"Change feed disconnected (retrying in {delay:.0f}s): {e}")
+            finally:
+                self._connected = False
+                if conn is not None:
+                    conn.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _MAX_RECONNECT_DELAY)
+
+    async def _listen(self, conn) -> None:
+        """Wait for notifications on the connection's socket until it fails."""
+        loop = asyncio.get_running_loop()
+        lost = loop.create_future()
+        fd = conn.fileno()
+        loop.add_reader(fd, self._on_readable, conn, lost)
+        try:
+            await lost
+        finally:
+            loop.remove_reader(fd)
+
+    def _on_readable(self, conn, lost: asyncio.Future) -> None:
+        try:
+            conn.poll()
+        except Exception as e:
+            if not lost.done():
+                lost.set_exception(e)
+            return
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            self.metrics["notifications"] += 1
+            self._pending.update(tag for tag in notify.payload.split(",") if tag)
+        if self._pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        # Tags that arrive during an eviction are picked up by the next round
+        while self._pending:
+            tags, self._pending = self._pending, set()
+            self.metrics["tags"] += len(tags)
+            self.metrics["evicted"] += await invalidate_tags(*tags)
+            self.last_notification = time.time()
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "enabled": change_feed_available(),
+            "connected": self._connected,
+            "last_notification": self.last_notification,
+        }
+
+
+change_feed = ChangeFeed()
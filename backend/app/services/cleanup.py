@@ -0,0 +1,156 @@
+"""
+Submission File Cleanup
+Batched, resumable removal of expired answer-sheet PDFs. Expired submissions are
+paged with a keyset cursor; each page's objects are removed in one storage call
+and their file_url cleared with one bulk update, so an interrupted run simply
+continues where it stopped next time. A lease in job_locks ensures only one
+runner (worker, cron or admin request) works at a time.
+
+Run from cron or by hand:  python -m app.services.cleanup [--max-pages N]
+"""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from app.services.supabase import get_async_supabase_admin
+from app.services.pagination import keyset_filter
+
+STORAGE_BUCKET = "answers"
+SUBMISSION_FILE_RETENTION_HOURS = float(os.getenv("SUBMISSION_FILE_RETENTION_HOURS", "24"))
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "200"))  # storage accepts up to 1000 paths per call
+# In-process schedule; 0 disables it (use cron / the admin endpoint instead, e.g. on serverless)
+CLEANUP_INTERVAL_SECONDS = float(os.getenv("CLEANUP_INTERVAL_SECONDS", "3600"))
+CLEANUP_LOCK_TTL = int(os.getenv("CLEANUP_LOCK_TTL", "900"))
+CLEANUP_LOCK_NAME = "submission_file_cleanup"
+
+_last_report: Optional[dict] = None
+
+
+class JobLockedError(Exception):
+    """Raised when another runner currently holds the cleanup lock."""
+
+
+def storage_path(file_url: str) -> str:
+    """Object path inside the answers bucket (.../object/public/answers/<path>)."""
+    return file_url.split(f"/{STORAGE_BUCKET}/", 1)[-1].split("?", 1)[0]
+
+
+async def _acquire(sb, holder: str) -> bool:
+    res = await sb.rpc(
+        "try_acquire_job_lock",
+        {"p_name": CLEANUP_LOCK_NAME, "p_holder": holder, "p_ttl_seconds": CLEANUP_LOCK_TTL},
+    ).execute()
+    return bool(res.data)
+
+
+async def run_cleanup(max_pages: Optional[int] = None) -> dict:
+    """
+    Remove stored files of submissions older than the retention window.
+    Returns a report of files and bytes reclaimed. Raises JobLockedError if
+    another run is in progress.
+    """
+    global _last_report
+    sb = await get_async_supabase_admin()
+    holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    if not await _acquire(sb, holder):
+        raise JobLockedError("Cleanup is already running")
+
+    started = time.perf_counter()
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=SUBMISSION_FILE_RETENTION_HOURS)).isoformat()
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "cutoff": cutoff,
+        "pages": 0,
+        "submissions_cleared": 0,
+        "files_removed": 0,
+        "files_missing": 0,
+        "files_failed": 0,
+        "bytes_reclaimed": 0,
+        "completed": False,
+    }
+    cursor = None
+    try:
+        while max_pages is None or report["pages"] < max_pages:
+            query = (
+                sb.table("submissions")
+                .select("id, file_url, submitted_at")
+                .lt("submitted_at", cutoff)
+                .not_.is_("file_url", "null")
+            )
+            if cursor:
+                query = query.or_(keyset_filter("submitted_at", cursor[0], cursor[1], desc=False))
+            page = await query.order("submitted_at").order("id").limit(CLEANUP_BATCH_SIZE).execute()
+            rows = page.data or []
+            if not rows:
+                report["completed"] = True
+                break
+            report["pages"] += 1
+            cursor = (rows[-1]["submitted_at"], rows[-1]["id"])
+
+            paths = {storage_path(r["file_url"]) for r in rows}
+            try:
+                removed = await sb.storage.from_(STORAGE_BUCKET).remove(sorted(paths))
+            except Exception as e:
+                # Leave file_url in place; the rows are retried on the next run
+                print(f"Cleanup: failed to remove {len(paths)} files: {e}")
+                report["files_failed"] += len(paths)
+            else:
+                report["files_removed"] += len(removed)
+                report["files_missing"] += len(paths) - len(removed)
+                report["bytes_reclaimed"] += sum(int((o.get("metadata") or {}).get("size") or 0) for o in removed)
+
+                await sb.table("submissions").update(
+                    {"file_url": None, "answers": {"info": f"File auto-deleted after {SUBMISSION_FILE_RETENTION_HOURS:g}h"}},
+                    returning="minimal",
+                ).in_("id", [r["id"] for r in rows]).execute()
+                report["submissions_cleared"] += len(rows)
+
+            # Extend the lease for long runs
+            await _acquire(sb, holder)
+    finally:
+        try:
+            await sb.rpc("release_job_lock", {"p_name": CLEANUP_LOCK_NAME, "p_holder": holder}).execute()
+        except Exception as e:
+            print(f"Cleanup: failed to release lock (expires in {CLEANUP_LOCK_TTL}s): {e}")
+        report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        _last_report = report
+
+    print(
+        f"[{datetime.now().isoformat()}] Cleanup: cleared {report['submissions_cleared']} submissions, "
+        f"removed {report['files_removed']} files ({report['bytes_reclaimed']} bytes)."
+    )
+    return report
+
+
+def get_last_report() -> Optional[dict]:
+    """Report of the most recent cleanup run in this process."""
+    return _last_report
+
+
+async def cleanup_loop() -> None:
+    """Periodic in-process cleanup; safe to run in every worker thanks to the lock."""
+    while True:
+        try:
+            await run_cleanup()
+        except JobLockedError:
+            pass
+        except Exception as e:
+            print(f"Error in submission cleanup: {e}")
+        await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Remove expired submission files from storage.")
+    parser.add_argument("--max-pages", type=int, default=None, help="Stop after this many pages")
+    args = parser.parse_args()
+    try:
+        print(json.dumps(asyncio.run(run_cleanup(args.max_pages)), indent=2))
+    except JobLockedError as e:
+        print(e)
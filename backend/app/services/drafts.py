@@ -0,0 +1,234 @@
+"""
+Draft Answers (Autosave)
+Per-question answer deltas for in-progress exams, coalesced in memory and
+persisted periodically with one batched merge RPC per flush. A delta the
+database rejects is isolated from the batch and dropped after a few attempts.
+With DRAFT_FLUSH_INTERVAL=0 (e.g. serverless) there is no background flusher
+and every save is persisted before it returns.
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Dict, Iterable, Optional, Tuple
+from app.services.supabase import get_async_supabase_admin, is_data_error
+
+# In-process flush schedule; 0 disables it and persists each save immediately
+DRAFT_FLUSH_INTERVAL = float(os.getenv("DRAFT_FLUSH_INTERVAL", "5"))
+# Flushes a rejected delta is retried for before it is dropped
+DRAFT_MAX_ATTEMPTS = int(os.getenv("DRAFT_MAX_ATTEMPTS", "3"))
+
+DraftKey = Tuple[str, str]  # (exam_id, student_id)
+
+
+class _Delta:
+    """Coalesced changes for one draft: answers set and question ids cleared."""
+
+    __slots__ = ("set", "unset")
+
+    def __init__(self):
+        self.set: Dict[str, object] = {}
+        self.unset: set = set()
+
+    def apply(self, answers: dict, removed: Iterable[str]) -> None:
+        for qid in removed:
+            self.set.pop(qid, None)
+            self.unset.add(qid)
+        for qid, value in answers.items():
+            self.unset.discard(qid)
+            self.set[qid] = value
+
+    def merge_under(self, newer: "_Delta") -> "_Delta":
+        """Combine an older (failed-to-flush) delta with a newer one."""
+        self.apply(newer.set, newer.unset)
+        return self
+
+    def applied_to(self, answers: dict) -> dict:
+        merged = {k: v for k, v in answers.items() if k not in self.unset}
+        merged.update(self.set)
+        return merged
+
+
+class DraftStore:
+    """Write-coalescing autosave buffer in front of the submission_drafts table."""
+
+    def __init__(self, flush_interval: float = DRAFT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending: Dict[DraftKey, _Delta] = {}
+        self._inflight: Dict[DraftKey, _Delta] = {}  # batch of the flush under way
+        self._flushes_done = 0
+        self._attempts: Dict[DraftKey, int] = {}  # failed flushes of deltas the database rejected
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._rows_window: deque = deque()  # (timestamp, rows written)
+        self.metrics = {
+            "deltas_received": 0,
+            "bytes_in": 0,
+            "keys_changed": 0,
+            "flushes": 0,
+            "rows_written": 0,
+            "flush_errors": 0,
+            "rejected": 0,
+            "dropped": 0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Final draft flush failed: {e}")
+
+    async def save(self, exam_id: str, student_id: str, answers: dict, removed: Iterable[str], size: int = 0) -> int:
+        """Record a delta. Returns the number of questions with unflushed changes for this draft."""
+        removed = list(removed)
+        delta = self._pending.setdefault((exam_id, student_id), _Delta())
+        delta.apply(answers, removed)
+
+        self.metrics["deltas_received"] += 1
+        self.metrics["bytes_in"] += size
+        self.metrics["keys_changed"] += len(answers) + len(removed)
+
+        # Without the background flusher (e.g. serverless) persist immediately
+        if not self.running:
+            await self.flush()
+            return 0
+        return len(delta.set) + len(delta.unset)
+
+    async def _read(self, exam_id: str, student_id: str) -> dict:
+        sb = await get_async_supabase_admin()
+        row = await sb.table("submission_drafts").select("answers").eq("exam_id", exam_id).eq("student_id", student_id).maybe_single().execute()
+        return (row.data.get("answers") or {}) if row and row.data else {}
+
+    async def load(self, exam_id: str, student_id: str) -> dict:
+        """Current draft answers: persisted row + this worker's in-flight and unflushed changes."""
+        for _ in range(3):
+            flushes = self._flushes_done
+            answers = await self._read(exam_id, student_id)
+            # A flush that finished during the read may have taken changes out of
+            # the in-flight map that the row did not show yet
+            if flushes == self._flushes_done:
+                break
+        else:
+            async with self._flush_lock:
+                answers = await self._read(exam_id, student_id)
+        for layer in (self._inflight, self._pending):
+            delta = layer.get((exam_id, student_id))
+            if delta:
+                answers = delta.applied_to(answers)
+        return dict(answers)
+
+    async def discard(self, exam_id: str, student_id: str) -> None:
+        """Delete a draft (unflushed changes and persisted row) once the exam has been submitted."""
+        # After any in-flight merge, which would otherwise re-create the row
+        async with self._flush_lock:
+            self._pending.pop((exam_id, student_id), None)
+            self._attempts.pop((exam_id, student_id), None)
+            sb = await get_async_supabase_admin()
+            await sb.table("submission_drafts").delete().eq("exam_id", exam_id).eq("student_id", student_id).execute()
+
+    def _requeue(self, key: DraftKey, delta: _Delta) -> None:
+        # Put the changes back underneath anything that arrived meanwhile
+        newer = self._pending.get(key)
+        self._pending[key] = delta.merge_under(newer) if newer else delta
+
+    async def _merge(self, sb, items: list) -> Dict[DraftKey, str]:
+        """
+        Merge deltas with one RPC, halving the batch on data errors until each
+        rejected delta is alone. Returns {key: error} for those; other errors propagate.
+        """
+        payload = [
+            {"exam_id": e, "student_id": s, "set": d.set, "unset": sorted(d.unset)}
+            for (e, s), d in items
+        ]
+        try:
+            await sb.rpc("merge_submission_drafts", {"p_deltas": payload}).execute()
+            return {}
+        except Exception as e:
+            if not is_data_error(e):
+                raise
+            if len(items) == 1:
+                return {items[0][0]: str(e)}
+        mid = len(items) // 2
+        return {**await self._merge(sb, items[:mid]), **await self._merge(sb, items[mid:])}
+
+    async def flush(self) -> int:
+        """Persist all coalesced deltas (one RPC unless some are rejected). Returns rows written."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+            items = list(batch.items())
+            try:
+                sb = await get_async_supabase_admin()
+                rejected = await self._merge(sb, items)
+            except Exception:
+                for key, delta in items:
+                    self._requeue(key, delta)
+                self.metrics["flush_errors"] += 1
+                raise
+            finally:
+                self._inflight = {}
+                self._flushes_done += 1
+
+            for key, error in rejected.items():
+                attempts = self._attempts.get(key, 0) + 1
+                self.metrics["rejected"] += 1
+                if attempts >= DRAFT_MAX_ATTEMPTS:
+                    self._attempts.pop(key, None)
+                    self.metrics["dropped"] += 1
+                    print(f"Dropping draft changes for exam {key[0]}, student {key[1]} after {attempts} attempts: {error}")
+                else:
+                    self._attempts[key] = attempts
+                    self._requeue(key, batch[key])
+            for key, _ in items:
+                if key not in rejected:
+                    self._attempts.pop(key, None)
+
+            written = len(items) - len(rejected)
+            self.metrics["flushes"] += 1
+            self.metrics["rows_written"] += written
+            self._rows_window.append((time.monotonic(), written))
+            return written
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Draft flush failed (will retry): {e}")
+
+    def stats(self) -> dict:
+        """Write-amplification metrics for autosave."""
+        cutoff = time.monotonic() - 60
+        while self._rows_window and self._rows_window[0][0] < cutoff:
+            self._rows_window.popleft()
+        received = self.metrics["deltas_received"]
+        return {
+            **self.metrics,
+            "running": self.running,
+            "pending_drafts": len(self._pending),
+            "rows_written_last_minute": sum(n for _, n in self._rows_window),
+            "deltas_per_row_written": round(received / self.metrics["rows_written"], 2) if self.metrics["rows_written"] else None,
+        }
+
+
+draft_store = DraftStore()
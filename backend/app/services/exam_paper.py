@@ -0,0 +1,89 @@
+"""
+Exam Paper Cache
+Builds the student-facing exam paper (exam + questions without answers) once per
+exam version, pre-serialised to JSON bytes with an ETag. Cached entries are
+tagged "exam:{id}" alongside other per-exam caches.
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+from typing import Optional
+from app.services.supabase import get_async_supabase_admin, coalesced
+from app.services.cache import Cache, invalidate_tags
+
+EXAM_PAPER_CACHE_TTL = float(os.getenv("EXAM_PAPER_CACHE_TTL", "300"))
+EXAM_PAPER_CACHE_SIZE = int(os.getenv("EXAM_PAPER_CACHE_SIZE", "256"))
+
+paper_cache = Cache("exam_paper", ttl=EXAM_PAPER_CACHE_TTL, maxsize=EXAM_PAPER_CACHE_SIZE)
+
+
+def exam_tag(exam_id: str) -> str:
+    return f"exam:{exam_id}"
+
+
+def paper_tag(exam_id: str) -> str:
+    return f"exam_paper:{exam_id}"
+
+
+class ExamPaper:
+    """A rendered exam paper. `exam` is the raw exam row and must not be mutated."""
+
+    __slots__ = ("exam", "body", "etag")
+
+    def __init__(self, exam: dict, body: bytes, etag: str):
+        self.exam = exam
+        self.body = body
+        self.etag = etag
+
+    def to_dict(self) -> dict:
+        return {"exam": self.exam, "body": self.body, "etag": self.etag}
+
+
+async def _build_exam_paper(exam_id: str) -> Optional[ExamPaper]:
+    sb = await get_async_supabase_admin()
+    exam, questions = await asyncio.gather(
+        sb.table("exams").select("*").eq("id", exam_id).maybe_single().execute(),
+        sb.table("questions").select("*").eq("exam_id", exam_id).order("order_num").execute(),
+    )
+    if not exam or not exam.data:
+        return None
+
+    q_list = questions.data or []
+    for q in q_list:
+        q.pop("correct_answer", None)  # Hide answers from students
+
+    paper = {**exam.data, "questions": q_list}
+    body = json.dumps(paper, separators=(",", ":"), default=str).encode()
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return ExamPaper(exam.data, body, etag)
+
+
+async def get_exam_paper(exam_id: str) -> Optional[ExamPaper]:
+    """Return the cached exam paper, building it on first use. None if the exam does not exist."""
+    cached = await paper_cache.get(exam_id)
+    if cached is not None:
+        return ExamPaper(**cached)
+    # Exam-start stampede: concurrent misses share one build (and one cache write)
+    return await coalesced(("exam_paper", exam_id), lambda: _load_exam_paper(exam_id), copy_result=False)
+
+
+async def _load_exam_paper(exam_id: str) -> Optional[ExamPaper]:
+    tags = [exam_tag(exam_id), paper_tag(exam_id)]
+    versions = await paper_cache.versions(tags)
+    paper = await _build_exam_paper(exam_id)
+    if paper is not None:
+        # Not stored if the exam was invalidated while it was being read
+        await paper_cache.set(exam_id, paper.to_dict(), tags=tags, versions=versions)
+    return paper
+
+
+async def invalidate_exam_paper(exam_id: str) -> None:
+    """Drop the cached paper after the exam or its questions change."""
+    await invalidate_tags(paper_tag(exam_id))
+
+
+async def invalidate_exam(exam_id: str) -> None:
+    """Drop every cached entry tagged with the exam (paper, analytics)."""
+    await invalidate_tags(exam_tag(exam_id))
@@ -0,0 +1,208 @@
+"""
+Exam Lifecycle Scheduler
+Moves exams scheduled → active → completed on time. Upcoming start / end
+boundaries are kept in a min-heap; when one falls due a single set-based RPC
+applies every transition that is due. Exam changes are picked up incrementally
+through exams.updated_at, and the known windows give submit_exam a deadline
+check without fetching the exam again.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from app.services.supabase import get_async_supabase_admin
+from app.services.exam_paper import invalidate_exam_paper
+
+EXAM_SCHEDULER_ENABLED = os.getenv("EXAM_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+EXAM_SCHEDULER_REFRESH_INTERVAL = float(os.getenv("EXAM_SCHEDULER_REFRESH_INTERVAL", "30"))
+# Re-read changes this far behind the last refresh (clock skew, late commits)
+EXAM_SCHEDULER_REFRESH_OVERLAP = float(os.getenv("EXAM_SCHEDULER_REFRESH_OVERLAP", "60"))
+# Submissions are still accepted this long after the exam ends (upload time)
+SUBMISSION_GRACE_SECONDS = int(os.getenv("SUBMISSION_GRACE_SECONDS", "120"))
+
+OPEN_STATUSES = ("scheduled", "active")
+_RETRY_DELAY = 5.0
+
+
+def _timestamp(value: str) -> float:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def exam_window(exam: dict) -> Tuple[float, float]:
+    """(start, submission deadline) of an exam row as epoch seconds; the deadline includes the grace period."""
+    start = _timestamp(exam["scheduled_at"])
+    return start, start + exam["duration_minutes"] * 60 + SUBMISSION_GRACE_SECONDS
+
+
+class ExamScheduler:
+    """In-process timer for exam status transitions."""
+
+    def __init__(self, refresh_interval: float = EXAM_SCHEDULER_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._windows: Dict[str, Tuple[float, float]] = {}  # exam_id → (start, deadline), open exams only
+        self._status: Dict[str, str] = {}
+        self._heap: List[Tuple[float, str]] = []  # (boundary, exam_id); stale entries are skipped
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._next_refresh = 0.0
+        self._retry_at: Optional[float] = None
+        self._watermark: Optional[datetime] = None
+        self.metrics = {"refreshes": 0, "rows_refreshed": 0, "advances": 0, "transitions": 0, "errors": 0}
+
+    # ──── Tracking ────
+
+    async def track(self, exam: dict) -> None:
+        """Record the current state of an exam row (id, status, scheduled_at, duration_minutes)."""
+        exam_id = exam["id"]
+        status = exam.get("status")
+        previous = self._status.get(exam_id)
+        if previous is not None and previous != status:
+            await invalidate_exam_paper(exam_id)
+
+        if status not in OPEN_STATUSES or not exam.get("scheduled_at") or not exam.get("duration_minutes"):
+            self.forget(exam_id)
+            return
+
+        window = exam_window(exam)
+        self._status[exam_id] = status
+        if self._windows.get(exam_id) == window:
+            return
+        self._windows[exam_id] = window
+        start, deadline = window
+        if status == "scheduled":
+            self._push(start, exam_id)
+        self._push(deadline, exam_id)
+
+    def forget(self, exam_id: str) -> None:
+        self._windows.pop(exam_id, None)
+        self._status.pop(exam_id, None)
+
+    def _push(self, when: float, exam_id: str) -> None:
+        first = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (when, exam_id))
+        if self._wakeup is not None and (first is None or when < first):
+            self._wakeup.set()
+
+    def accepting_submissions(self, exam_id: str, exam: Optional[dict] = None) -> bool:
+        """
+        Deadline check from the known exam window (or the given exam row).
+        True when the window is unknown; the database status check decides then.
+        """
+        window = self._windows.get(exam_id)
+        if window is None and exam is not None and exam.get("scheduled_at") and exam.get("duration_minutes"):
+            window = exam_window(exam)
+        return window is None or time.time() <= window[1]
+
+    # ──── Database sync ────
+
+    async def refresh(self) -> int:
+        """Load open exams on the first call, then only exams changed since the last refresh."""
+        sb = await get_async_supabase_admin()
+        started = datetime.now(timezone.utc)
+        query = sb.table("exams").select("id, status, scheduled_at, duration_minutes")
+        if self._watermark is None:
+            query = query.in_("status", list(OPEN_STATUSES))
+        else:
+            since = self._watermark - timedelta(seconds=EXAM_SCHEDULER_REFRESH_OVERLAP)
+            query = query.gte("updated_at", since.isoformat())
+        rows = (await query.execute()).data or []
+
+        for row in rows:
+            await self.track(row)
+        self._watermark = started
+        self.metrics["refreshes"] += 1
+        self.metrics["rows_refreshed"] += len(rows)
+        return len(rows)
+
+    async def advance(self) -> int:
+        """Apply every due transition in one statement. Returns the number of exams changed."""
+        sb = await get_async_supabase_admin()
+        result = await sb.rpc("advance_exam_statuses", {"p_grace_seconds": SUBMISSION_GRACE_SECONDS}).execute()
+        rows = result.data or []
+        for row in rows:
+            await self.track(row)
+        self.metrics["advances"] += 1
+        self.metrics["transitions"] += len(rows)
+        if rows:
+            print(f"Exam scheduler: {len(rows)} status transitions applied")
+        return len(rows)
+
+    def _pop_due(self, now: float) -> List[Tuple[float, str]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, exam_id = heapq.heappop(self._heap)
+            window = self._windows.get(exam_id)
+            if window is not None and when in window:
+                due.append((when, exam_id))
+        return due
+
+    # ──── Background task ────
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            now = time.time()
+            if now >= self._next_refresh:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    self.metrics["errors"] += 1
+                    print(f"Exam scheduler refresh failed: {e}")
+                self._next_refresh = time.time() + self.refresh_interval
+
+            now = time.time()
+            due = self._pop_due(now)
+            if due or (self._retry_at is not None and now >= self._retry_at):
+                try:
+                    await self.advance()
+                    self._retry_at = None
+                except Exception as e:
+                    self.metrics["errors"] += 1
+                    self._retry_at = time.time() + _RETRY_DELAY
+                    print(f"Exam scheduler transition failed (retrying): {e}")
+
+            timeout = self._next_refresh - time.time()
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - time.time())
+            if self._retry_at is not None:
+                timeout = min(timeout, self._retry_at - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        upcoming = next((w for w, e in sorted(self._heap) if e in self._windows and w in self._windows[e]), None)
+        return {
+            **self.metrics,
+            "running": self.running,
+            "tracked_exams": len(self._windows),
+            "heap_size": len(self._heap),
+            "next_transition_in_s": round(upcoming - time.time(), 1) if upcoming is not None else None,
+        }
+
+
+exam_scheduler = ExamScheduler()
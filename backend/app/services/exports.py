@@ -0,0 +1,169 @@
+"""
+Result Exports
+Streams results joined with student and exam details as CSV or XLSX. Rows are
+read in keyset-paginated pages (student/exam data embedded per page), so memory
+use does not grow with the size of the export. Free-text cells are escaped so
+spreadsheet apps do not evaluate them as formulas.
+"""
+
+import os
+import io
+import csv
+import asyncio
+import tempfile
+from typing import AsyncIterator, List, Optional
+from app.services.supabase import get_async_supabase_admin
+from app.services.pagination import keyset_filter
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # optional: only needed for XLSX exports
+    Workbook = None
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+_FILE_CHUNK = 64 * 1024
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+HEADER = [
+    "Reg Number", "Student", "Email", "Department", "Exam", "Subject", "Exam Date",
+    "Marks Obtained", "Total Marks", "Percentage", "Grade", "Published", "Remarks",
+]
+
+
+def xlsx_available() -> bool:
+    return Workbook is not None
+
+
+class ResultExport:
+    """Keyset-paged results query, ordered by (student_id, id)."""
+
+    def __init__(
+        self,
+        exam_id: Optional[str] = None,
+        department: Optional[str] = None,
+        published_only: bool = False,
+        page_size: int = EXPORT_PAGE_SIZE,
+    ):
+        self.exam_id = exam_id
+        self.department = department
+        self.published_only = published_only
+        self.page_size = page_size
+
+    def _columns(self) -> str:
+        student = "student:profiles!student_id!inner" if self.department else "student:profiles!student_id"
+        return (
+            "id, student_id, marks_obtained, total_marks, percentage, grade, published, remarks, "
+            f"{student}(full_name, email, reg_number, department), "
+            "exam:exams(title, subject, scheduled_at)"
+        )
+
+    async def pages(self) -> AsyncIterator[List[dict]]:
+        sb = await get_async_supabase_admin()
+        cursor = None
+        while True:
+            query = sb.table("results").select(self._columns())
+            if self.exam_id:
+                query = query.eq("exam_id", self.exam_id)
+            if self.department:
+                query = query.eq("student.department", self.department)
+            if self.published_only:
+                query = query.eq("published", True)
+            if cursor:
+                query = query.or_(keyset_filter("student_id", cursor[0], cursor[1], desc=False))
+            result = await query.order("student_id").order("id").limit(self.page_size).execute()
+            rows = result.data or []
+            # Only an empty page ends the export: the server may cap pages below page_size
+            if not rows:
+                return
+            yield rows
+            cursor = (rows[-1]["student_id"], rows[-1]["id"])
+
+
+# Leading characters that make Excel / LibreOffice / Sheets treat a cell as a formula
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _safe(value):
+    """Neutralise user-entered text that a spreadsheet would evaluate (CSV / formula injection)."""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _flatten(row: dict) -> list:
+    student = row.get("student") or {}
+    exam = row.get("exam") or {}
+    return [
+        _safe(student.get("reg_number")), _safe(student.get("full_name")), _safe(student.get("email")),
+        _safe(student.get("department")), _safe(exam.get("title")), _safe(exam.get("subject")),
+        (exam.get("scheduled_at") or "")[:10],
+        row.get("marks_obtained"), row.get("total_marks"), row.get("percentage"), _safe(row.get("grade")),
+        "yes" if row.get("published") else "no", _safe(row.get("remarks")),
+    ]
+
+
+async def _prefetched(pages: AsyncIterator[List[dict]]) -> AsyncIterator[List[dict]]:
+    """
+    Fetch the first page before the response starts, so query errors still
+    become a proper HTTP error instead of a truncated download.
+    """
+    try:
+        first = await pages.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def chained():
+        if first is not None:
+            yield first
+        async for page in pages:
+            yield page
+
+    return chained()
+
+
+async def _csv_chunks(pages: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM so Excel opens the file as UTF-8
+    writer.writerow(HEADER)
+    async for page in pages:
+        writer.writerows(_flatten(r) for r in page)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def _xlsx_chunks(pages: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    # XLSX is a zip and cannot be streamed while it is written; write-only mode
+    # spools rows to disk, then the finished file is streamed in chunks.
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Results")
+    sheet.append(HEADER)
+    async for page in pages:
+        for row in page:
+            sheet.append(_flatten(row))
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(workbook.save, path)
+        with open(path, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, _FILE_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+async def stream_export(export: ResultExport, fmt: str) -> AsyncIterator[bytes]:
+    """Byte stream of the export in the given format ("csv" or "xlsx")."""
+    pages = await _prefetched(export.pages())
+    return _xlsx_chunks(pages) if fmt == "xlsx" else _csv_chunks(pages)
@@ -0,0 +1,238 @@
+"""
+Grading Engine
+Table-driven grading scales (per exam / department, cached), paged bulk regrading and
+vectorised MCQ auto-scoring over a students × questions answer matrix
+"""
+
+import os
+import json
+import bisect
+import hashlib
+import numpy as np
+from typing import List, Optional, Iterable, Tuple
+from app.services.supabase import get_async_supabase_admin
+from app.services.pagination import iter_pages
+from app.services.cache import Cache, invalidate_tags
+from app.services.performance import refresh_performance
+
+GRADING_SCALE_CACHE_TTL = float(os.getenv("GRADING_SCALE_CACHE_TTL", "600"))
+
+# (minimum percentage, grade), lowest first
+DEFAULT_BANDS = [(0, "F"), (40, "D"), (50, "C"), (60, "B"), (70, "B+"), (80, "A"), (90, "A+")]
+
+UNANSWERED = -1
+
+
+class GradingScale:
+    """Percentage → grade ladder. Bands are (minimum percentage, grade) pairs."""
+
+    def __init__(self, bands: Iterable):
+        pairs = sorted((float(b[0]), str(b[1])) for b in bands)
+        if not pairs or pairs[0][0] > 0:
+            raise ValueError("A grading scale needs a band starting at 0%")
+        if len({t for t, _ in pairs}) != len(pairs):
+            raise ValueError("Grading scale thresholds must be unique")
+        self.thresholds = [t for t, _ in pairs]
+        self.grades = [g for _, g in pairs]
+        self._threshold_array = np.array(self.thresholds, dtype=float)
+        self._grade_array = np.array(self.grades, dtype=object)
+
+    @classmethod
+    def from_row(cls, bands: list) -> "GradingScale":
+        """Build from the JSON stored in grading_scales.bands."""
+        return cls((b["min_percentage"], b["grade"]) for b in bands)
+
+    def grade(self, percentage: float) -> str:
+        """Letter grade for a single percentage."""
+        return self.grades[max(bisect.bisect_right(self.thresholds, percentage) - 1, 0)]
+
+    def grade_many(self, percentages: np.ndarray) -> List[str]:
+        """Letter grades for an array of percentages."""
+        idx = np.searchsorted(self._threshold_array, percentages, side="right") - 1
+        return self._grade_array[np.clip(idx, 0, None)].tolist()
+
+
+DEFAULT_SCALE = GradingScale(DEFAULT_BANDS)
+
+
+def percentages_for(marks_obtained: np.ndarray, total_marks) -> np.ndarray:
+    """Percentages rounded to 2 dp, as stored in results.percentage."""
+    return np.round(marks_obtained / total_marks * 100, 2)
+
+
+# ──── Scale lookup (all scales loaded in one query and cached) ────
+# The rows sit in the shared cache under SCALES_TAG, so an update on one worker
+# (or in the database, via the change feed) is seen by all. Grades that get
+# stored pass fresh=True and always read the current rows.
+
+SCALES_TAG = "grading_scales"
+_scale_cache = Cache("grading_scales", ttl=GRADING_SCALE_CACHE_TTL, maxsize=1)
+_parsed: Tuple[Optional[str], dict] = (None, {})  # (rows digest, parsed scales) for this process
+
+
+def _parse_scales(rows: list) -> dict:
+    scales = {"exam": {}, "department": {}}
+    for row in rows:
+        try:
+            scale = GradingScale.from_row(row["bands"])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring invalid grading scale {row}: {e}")
+            continue
+        if row.get("exam_id"):
+            scales["exam"][row["exam_id"]] = scale
+        elif row.get("department"):
+            scales["department"][row["department"]] = scale
+    return scales
+
+
+async def _load_scales(fresh: bool = False) -> dict:
+    global _parsed
+    rows = None if fresh else await _scale_cache.get("all")
+    if rows is None:
+        versions = await _scale_cache.versions([SCALES_TAG])
+        sb = await get_async_supabase_admin()
+        rows = (await sb.table("grading_scales").select("exam_id, department, bands").execute()).data or []
+        await _scale_cache.set("all", rows, tags=[SCALES_TAG], versions=versions)
+    digest = hashlib.sha256(json.dumps(rows, sort_keys=True, default=str).encode()).hexdigest()
+    if _parsed[0] != digest:
+        _parsed = (digest, _parse_scales(rows))
+    return _parsed[1]
+
+
+async def get_scale(exam_id: Optional[str] = None, department: Optional[str] = None, fresh: bool = False) -> GradingScale:
+    """
+    Resolve the scale for an exam: exam override → department scale → default.
+    Pass fresh=True when the grade will be stored, to bypass the cache.
+    """
+    return _resolve(await _load_scales(fresh), exam_id, department)
+
+
+def _resolve(scales: dict, exam_id: Optional[str], department: Optional[str]) -> GradingScale:
+    return scales["exam"].get(exam_id) or scales["department"].get(department) or DEFAULT_SCALE
+
+
+async def invalidate_scales() -> None:
+    await invalidate_tags(SCALES_TAG)
+
+
+async def regrade_exams(exam_ids: List[str]) -> int:
+    """
+    Recompute percentage and grade of every result of the given exams from the
+    exams' current total_marks and grading scales. Exams are handled one at a
+    time and their results in keyset pages, one bulk write per page.
+    Returns the number of results rewritten.
+    """
+    sb = await get_async_supabase_admin()
+    scales = await _load_scales(fresh=True)
+    regraded = 0
+    published_students = set()
+    for exam_id in dict.fromkeys(exam_ids):
+        exam = await sb.table("exams").select("id, total_marks, teacher:profiles!teacher_id(department)").eq("id", exam_id).maybe_single().execute()
+        if not exam or not exam.data:
+            continue
+        total_marks = exam.data["total_marks"]
+        scale = _resolve(scales, exam_id, (exam.data.get("teacher") or {}).get("department"))
+
+        async for rows in iter_pages(
+            lambda: sb.table("results").select("id, exam_id, student_id, marks_obtained, published").eq("exam_id", exam_id)
+        ):
+            marks = np.array([r["marks_obtained"] for r in rows], dtype=float)
+            percentages = percentages_for(marks, total_marks)
+            grades = scale.grade_many(percentages)
+            updates = [
+                {
+                    "id": r["id"],
+                    "exam_id": r["exam_id"],
+                    "student_id": r["student_id"],
+                    "marks_obtained": r["marks_obtained"],
+                    "total_marks": total_marks,
+                    "percentage": pct,
+                    "grade": grade,
+                }
+                for r, pct, grade in zip(rows, percentages.tolist(), grades)
+            ]
+            await sb.table("results").upsert(updates, on_conflict="id", returning="minimal").execute()
+            regraded += len(updates)
+            published_students.update(r["student_id"] for r in rows if r.get("published"))
+
+    # Published percentages changed: refresh those students' aggregates
+    await refresh_performance(published_students)
+    return regraded
+
+
+# ──── MCQ answer key ────
+
+def _normalise(value) -> str:
+    return " ".join(str(value).split()).casefold()
+
+
+def parse_options(options) -> list:
+    """Question options are stored either as a JSON array or a JSON-encoded string."""
+    if isinstance(options, str):
+        try:
+            options = json.loads(options)
+        except ValueError:
+            return []
+    return options if isinstance(options, list) else []
+
+
+def _option_lookup(options: list) -> dict:
+    """Map accepted spellings of an answer to its option index (text, then letter/number)."""
+    lookup = {}
+    for i, opt in enumerate(options):
+        lookup.setdefault(_normalise(opt), i)
+    for i in range(len(options)):
+        lookup.setdefault(chr(ord("a") + i), i)
+        lookup.setdefault(str(i + 1), i)
+    return lookup
+
+
+class AnswerKey:
+    """Answer key for the auto-gradable (MCQ) questions of an exam."""
+
+    def __init__(self, questions: List[dict]):
+        self.question_ids: List[str] = []
+        self.lookups: List[dict] = []
+        key, marks = [], []
+        self.manual_question_ids: List[str] = []
+
+        for q in questions:
+            lookup = _option_lookup(parse_options(q.get("options")))
+            correct = q.get("correct_answer")
+            correct_idx = lookup.get(_normalise(correct)) if correct not in (None, "") else None
+            if q.get("question_type") != "mcq" or correct_idx is None:
+                self.manual_question_ids.append(q["id"])
+                continue
+            self.question_ids.append(q["id"])
+            self.lookups.append(lookup)
+            key.append(correct_idx)
+            marks.append(q.get("marks") or 0)
+
+        self.key = np.array(key, dtype=np.int16)
+        self.marks = np.array(marks, dtype=np.int32)
+
+    @property
+    def fully_automatic(self) -> bool:
+        return not self.manual_question_ids and bool(self.question_ids)
+
+    def encode(self, answer_sets: List[Optional[dict]]) -> np.ndarray:
+        """Encode answers as a students × questions matrix of option indices (-1 = unanswered)."""
+        answer_sets = [a if isinstance(a, dict) else {} for a in answer_sets]
+        n = len(answer_sets)
+        matrix = np.full((n, len(self.question_ids)), UNANSWERED, dtype=np.int16)
+        for j, (qid, lookup) in enumerate(zip(self.question_ids, self.lookups)):
+            matrix[:, j] = np.fromiter(
+                (lookup.get(_normalise(a[qid]), UNANSWERED) if a.get(qid) is not None else UNANSWERED
+                 for a in answer_sets),
+                dtype=np.int16,
+                count=n,
+            )
+        return matrix
+
+    def correct(self, matrix: np.ndarray) -> np.ndarray:
+        """Boolean students × questions matrix of correct answers."""
+        return matrix == self.key[np.newaxis, :]
+
+    def score(self, matrix: np.ndarray) -> np.ndarray:
+        """Marks obtained per student on the MCQ questions."""
+        return self.correct(matrix).astype(np.int32) @ self.marks
@@ -0,0 +1,97 @@
+"""
+Keyset Pagination Helpers
+Opaque cursors and PostgREST filters for (sort column, id) keyset paging and text search,
+plus full reads of large tables in id-ordered pages
+"""
+
+import json
+import base64
+from typing import Any, AsyncIterator, Callable, List
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# PostgREST's default max-rows; larger limits are silently capped by the server
+MAX_PAGE_SIZE = 1000
+# Ids per in_() filter: 200 UUIDs keep the request URL under ~8 KB
+IN_FILTER_CHUNK = 200
+
+
+def encode_cursor(*values: Any) -> str:
+    """Encode the sort key of the last row on a page as an opaque cursor."""
+    raw = json.dumps(list(values), separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int = 2) -> List[Any]:
+    """Decode a cursor produced by encode_cursor. Raises ValueError if malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _quote(value: Any) -> str:
+    """Quote a value for use inside a PostgREST logical filter."""
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def keyset_filter(sort_column: str, sort_value: Any, id_value: Any, desc: bool = True, id_column: str = "id") -> str:
+    """
+    Build an `or_()` expression selecting rows strictly after (sort_value, id_value)
+    in (sort_column, id_column) order.
+    """
+    op = "lt" if desc else "gt"
+    return (
+        f"{sort_column}.{op}.{_quote(sort_value)},"
+        f"and({sort_column}.eq.{_quote(sort_value)},{id_column}.{op}.{_quote(id_value)})"
+    )
+
+
+def _like_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def ilike_any(columns: List[str], text: str) -> str:
+    """Build an `or_()` expression matching rows where any column contains `text` (case-insensitive)."""
+    pattern = f"*{_like_escape(text)}*"
+    return ",".join(f"{column}.ilike.{_quote(pattern)}" for column in columns)
+
+
+def ilike_in(column: str, values: List[str]) -> str:
+    """Build an `or_()` expression matching rows whose column equals any value, ignoring case."""
+    return ",".join(f"{column}.ilike.{_quote(_like_escape(v))}" for v in values)
+
+
+def prefix_pattern(text: str) -> str:
+    """LIKE pattern (PostgREST wildcard syntax) for values starting with `text`."""
+    return f"{_like_escape(text)}*"
+
+
+async def iter_pages(build: Callable[[], Any], page_size: int = MAX_PAGE_SIZE, id_column: str = "id") -> AsyncIterator[List[dict]]:
+    """
+    Yield every row of a query in `id_column` order, one keyset page at a time.
+    `build()` returns a fresh filtered select that includes `id_column`. Stops on
+    an empty page, so a server-side row cap cannot cut the read short.
+    """
+    last = None
+    while True:
+        query = build()
+        if last is not None:
+            query = query.gt(id_column, last)
+        rows = (await query.order(id_column).limit(page_size).execute()).data or []
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][id_column]
+
+
+async def fetch_all(build: Callable[[], Any], page_size: int = MAX_PAGE_SIZE, id_column: str = "id") -> List[dict]:
+    """All rows of a query, read with iter_pages."""
+    rows = []
+    async for page in iter_pages(build, page_size, id_column):
+        rows.extend(page)
+    return rows
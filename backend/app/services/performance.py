@@ -0,0 +1,58 @@
+"""
+Student Performance Aggregates
+Per-student totals over published results (count, sum, average, best/worst and
+a per-subject breakdown) kept in student_performance. Publishing an exam updates
+all of its students with one grouped statement; dashboards read a single row.
+
+Rebuild everything from results:  python -m app.services.performance --rebuild
+"""
+
+from typing import Iterable, Optional
+from app.services.supabase import get_async_supabase_admin
+
+
+async def publish_exam_results(exam_id: str) -> int:
+    """Publish an exam's results and refresh its students' aggregates. Returns students updated."""
+    sb = await get_async_supabase_admin()
+    result = await sb.rpc("publish_exam_results", {"p_exam_id": exam_id}).execute()
+    return result.data or 0
+
+
+async def refresh_performance(student_ids: Iterable[str]) -> int:
+    """Recompute the aggregates of the given students (after published results change)."""
+    ids = sorted(set(student_ids))
+    if not ids:
+        return 0
+    sb = await get_async_supabase_admin()
+    result = await sb.rpc("refresh_student_performance", {"p_student_ids": ids}).execute()
+    return result.data or 0
+
+
+async def rebuild_performance() -> int:
+    """Recompute the aggregates of every student from scratch."""
+    sb = await get_async_supabase_admin()
+    result = await sb.rpc("refresh_student_performance", {"p_student_ids": None}).execute()
+    return result.data or 0
+
+
+async def get_performance(student_id: str) -> Optional[dict]:
+    """The student's aggregate row, or None before any result is published."""
+    sb = await get_async_supabase_admin()
+    row = await sb.table("student_performance").select("*").eq("student_id", student_id).maybe_single().execute()
+    return row.data if row else None
+
+
+if __name__ == "__main__":
+    import asyncio
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintain student performance aggregates.")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute aggregates for all students")
+    parser.add_argument("--student", action="append", default=[], help="Recompute one student (repeatable)")
+    args = parser.parse_args()
+    if args.rebuild:
+        print(f"Rebuilt aggregates for {asyncio.run(rebuild_performance())} students")
+    elif args.student:
+        print(f"Refreshed aggregates for {asyncio.run(refresh_performance(args.student))} students")
+    else:
+        parser.print_help()
@@ -0,0 +1,72 @@
+"""
+Profile Service
+Cached lookup of user profiles by id (used by the auth dependency on every request).
+Entries are tagged "user:{id}" so one invalidation clears every cached view of a user.
+"""
+
+import os
+from typing import Optional, Iterable, Dict
+from app.services.supabase import get_async_supabase_admin, coalesced
+from app.services.cache import Cache, invalidate_tags
+
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "30"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "5000"))
+TEACHER_NAME_CACHE_TTL = float(os.getenv("TEACHER_NAME_CACHE_TTL", "3600"))
+
+profile_cache = Cache("profile", ttl=PROFILE_CACHE_TTL, maxsize=PROFILE_CACHE_SIZE)
+teacher_name_cache = Cache("teacher_name", ttl=TEACHER_NAME_CACHE_TTL, maxsize=2048)
+
+
+def user_tag(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+async def get_profile(user_id: str) -> Optional[dict]:
+    """Return the profile row for a user, served from cache when fresh."""
+    profile = await profile_cache.get(user_id)
+    if profile is not None:
+        return dict(profile)
+
+    profile = await coalesced(("profile", user_id), lambda: _load_profile(user_id))
+    return dict(profile) if profile else None
+
+
+async def _load_profile(user_id: str) -> Optional[dict]:
+    tags = [user_tag(user_id)]
+    versions = await profile_cache.versions(tags)
+    sb = await get_async_supabase_admin()
+    result = await sb.table("profiles").select("*").eq("id", user_id).single().execute()
+    if result.data:
+        # Not stored if the profile was invalidated while it was being read
+        await profile_cache.set(user_id, result.data, tags=tags, versions=versions)
+    return result.data
+
+
+async def get_teacher_names(teacher_ids: Iterable[str]) -> Dict[str, str]:
+    """Resolve teacher names by id: cached names first, one batched query for the rest."""
+    wanted = set(teacher_ids)
+    names = await teacher_name_cache.get_many(wanted)
+    missing = [t for t in wanted if t not in names]
+
+    if missing:
+        missing.sort()
+        rows = await coalesced(("teacher_names", *missing), lambda: _load_teacher_names(missing))
+        names.update((row["id"], row["full_name"]) for row in rows)
+
+    return names
+
+
+async def _load_teacher_names(teacher_ids: list) -> list:
+    versions = await teacher_name_cache.versions(map(user_tag, teacher_ids))
+    sb = await get_async_supabase_admin()
+    result = await sb.table("profiles").select("id, full_name").in_("id", teacher_ids).execute()
+    rows = result.data or []
+    # Skipped if any of these teachers was invalidated while they were being read
+    for row in rows:
+        await teacher_name_cache.set(row["id"], row["full_name"], tags=[user_tag(row["id"])], versions=versions)
+    return rows
+
+
+async def invalidate_profile(user_id: str) -> None:
+    """Drop a cached profile (and teacher name) so the next request sees the latest row."""
+    await invalidate_tags(user_tag(user_id))
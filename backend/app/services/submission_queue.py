@@ -0,0 +1,444 @@
+"""
+Write-Behind Submission Queue
+Optional buffered ingestion for end-of-exam bursts: submissions are durably
+acknowledged into a local SQLite (WAL) journal and flushed to `submissions`
+in batched multi-row inserts by a background task. Unflushed entries are
+replayed on the next start after a crash. A batch that Postgres rejects is
+split until the offending rows are isolated; those are kept in the journal as
+dead letters (failed_at / error) so they cannot block later submissions.
+
+Enable with SUBMISSION_BUFFER_ENABLED=true on long-running workers with a
+persistent disk (not on serverless, where /tmp does not survive) and point
+SUBMISSION_JOURNAL_DIR at a directory they share. Each worker locks its own
+journal-<n>.db there (the lowest free slot, so restarts reuse the same files)
+and moves the pending entries of unlocked journals, left by workers that are
+gone, into its own. Without fcntl (Windows) journals cannot be locked: run a
+single worker.
+
+Duplicates are answered from the local journal only, so accepting never waits
+on Postgres. A submission that loses to one made through another worker or
+direct mode is detected when flushed and kept as a dead letter.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import itertools
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from app.services.supabase import get_async_supabase_admin, is_data_error
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the journal is then unlocked
+    fcntl = None
+
+SUBMISSION_BUFFER_ENABLED = os.getenv("SUBMISSION_BUFFER_ENABLED", "false").lower() in ("1", "true", "yes")
+SUBMISSION_JOURNAL_DIR = os.getenv("SUBMISSION_JOURNAL_DIR", "")
+SUBMISSION_FLUSH_INTERVAL = float(os.getenv("SUBMISSION_FLUSH_INTERVAL", "0.5"))
+SUBMISSION_FLUSH_BATCH = int(os.getenv("SUBMISSION_FLUSH_BATCH", "500"))
+SUBMISSION_MAX_PENDING = int(os.getenv("SUBMISSION_MAX_PENDING", "20000"))
+# Flushed journal entries are kept this long for duplicate / retry detection
+SUBMISSION_JOURNAL_RETENTION = float(os.getenv("SUBMISSION_JOURNAL_RETENTION", str(24 * 3600)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    submission_id TEXT NOT NULL,
+    exam_id TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    idempotency_key TEXT,
+    payload TEXT NOT NULL,
+    accepted_at REAL NOT NULL,
+    flushed_at REAL,
+    failed_at REAL,
+    error TEXT,
+    UNIQUE (exam_id, student_id)
+);
+CREATE INDEX IF NOT EXISTS journal_pending ON journal (seq) WHERE flushed_at IS NULL;
+"""
+
+
+class QueueFullError(Exception):
+    """Raised when too many submissions are waiting to be flushed."""
+
+
+async def insert_submissions(rows: List[dict]) -> Set[str]:
+    """
+    Default writer: one multi-row insert. Returns the ids now stored in Postgres;
+    a row missing from the result lost to another submission by the same student.
+    """
+    sb = await get_async_supabase_admin()
+    result = await sb.table("submissions").upsert(
+        rows, on_conflict="exam_id,student_id", ignore_duplicates=True
+    ).execute()
+    stored = {r["id"] for r in result.data or []}
+    skipped = [r["id"] for r in rows if r["id"] not in stored]
+    if skipped:
+        # Replayed entries written before a crash are already there under their own id
+        present = await sb.table("submissions").select("id").in_("id", skipped).execute()
+        stored.update(r["id"] for r in present.data or [])
+    return stored
+
+
+def _lock(path: str):
+    """Exclusive non-blocking lock on path + ".lock"; None if another process holds it."""
+    lock_file = open(path + ".lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")  # acknowledged == on disk
+    conn.executescript(_SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(journal)")}
+    for name, decl in (("failed_at", "REAL"), ("error", "TEXT")):
+        if name not in columns:  # journals created before dead-lettering
+            conn.execute(f"ALTER TABLE journal ADD COLUMN {name} {decl}")
+    return conn
+
+
+class SubmissionQueue:
+    """SQLite-journaled write-behind buffer in front of the submissions table."""
+
+    def __init__(
+        self,
+        directory: str = SUBMISSION_JOURNAL_DIR,
+        writer: Callable[[List[dict]], Awaitable[Optional[Set[str]]]] = insert_submissions,
+        flush_interval: float = SUBMISSION_FLUSH_INTERVAL,
+        batch_size: int = SUBMISSION_FLUSH_BATCH,
+        max_pending: int = SUBMISSION_MAX_PENDING,
+    ):
+        if not directory:
+            raise ValueError("SUBMISSION_JOURNAL_DIR must be set when submission buffering is enabled")
+        self.directory = directory
+        self.path: Optional[str] = None
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pending = 0
+        self._dead_letters = 0
+
+        self._accepted_window: deque = deque()  # (second, count)
+        self.metrics = {
+            "accepted": 0,
+            "duplicates": 0,
+            "conflicts": 0,
+            "rejected_full": 0,
+            "replayed": 0,
+            "adopted": 0,
+            "flushed": 0,
+            "flush_batches": 0,
+            "flush_errors": 0,
+            "dead_lettered": 0,
+            "max_pending": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": 0.0,
+        }
+
+    # ──── Journal (runs in worker threads) ────
+
+    def _slot(self, n: int) -> str:
+        return os.path.join(self.directory, f"journal-{n}.db")
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if fcntl is None:
+            self.path = self._slot(0)
+        else:
+            for n in itertools.count():
+                lock_file = _lock(self._slot(n))
+                if lock_file is not None:
+                    self.path, self._lock_file = self._slot(n), lock_file
+                    break
+        conn = self._conn = _connect(self.path)
+        if fcntl is not None:
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if name.startswith("journal-") and name.endswith(".db") and path != self.path:
+                    self._adopt(path)
+        self._pending = conn.execute(
+            "SELECT COUNT(*) FROM journal WHERE flushed_at IS NULL AND failed_at IS NULL"
+        ).fetchone()[0]
+        self._dead_letters = conn.execute("SELECT COUNT(*) FROM journal WHERE failed_at IS NOT NULL").fetchone()[0]
+        self.metrics["replayed"] = self._pending
+
+    def _adopt(self, path: str) -> None:
+        """Move the pending entries of an unlocked journal (its worker is gone) into this one."""
+        lock_file = _lock(path)
+        if lock_file is None:
+            return  # a live worker's journal
+        try:
+            orphan = _connect(path)
+            try:
+                rows = orphan.execute(
+                    "SELECT seq, submission_id, exam_id, student_id, idempotency_key, payload, accepted_at "
+                    "FROM journal WHERE flushed_at IS NULL AND failed_at IS NULL ORDER BY seq"
+                ).fetchall()
+                if not rows:
+                    return
+                moved, conflicts = [], []
+                self._conn.execute("BEGIN")
+                try:
+                    for seq, submission_id, exam_id, student_id, key, payload, accepted_at in rows:
+                        self._conn.execute(
+                            "INSERT OR IGNORE INTO journal (submission_id, exam_id, student_id, idempotency_key, payload, accepted_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            (submission_id, exam_id, student_id, key, payload, accepted_at),
+                        )
+                        existing = self._conn.execute(
+                            "SELECT submission_id FROM journal WHERE exam_id = ? AND student_id = ?", (exam_id, student_id)
+                        ).fetchone()[0]
+                        # Same id: moved now, or by an adoption that crashed before the orphan was updated
+                        (moved if existing == submission_id else conflicts).append(seq)
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                orphan.execute("BEGIN")
+                orphan.executemany("DELETE FROM journal WHERE seq = ?", [(s,) for s in moved])
+                orphan.executemany(
+                    "UPDATE journal SET failed_at = ?, error = ? WHERE seq = ?",
+                    [(time.time(), "conflict: the student already has a submission in another journal", s) for s in conflicts],
+                )
+                orphan.execute("COMMIT")
+                self.metrics["adopted"] += len(moved)
+                self.metrics["conflicts"] += len(conflicts)
+                print(f"Submission journal: took over {len(moved)} unflushed submissions from {path}")
+            finally:
+                orphan.close()
+        finally:
+            lock_file.close()
+
+    def _append(self, exam_id: str, student_id: str, idempotency_key: Optional[str], row: dict) -> Tuple[str, bool, Optional[str]]:
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO journal (submission_id, exam_id, student_id, idempotency_key, payload, accepted_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (row["id"], exam_id, student_id, idempotency_key, json.dumps(row), time.time()),
+            )
+            if cur.rowcount:
+                self._pending += 1
+                return row["id"], True, idempotency_key
+            existing = self._conn.execute(
+                "SELECT submission_id, idempotency_key FROM journal WHERE exam_id = ? AND student_id = ?",
+                (exam_id, student_id),
+            ).fetchone()
+            return existing[0], False, existing[1]
+
+    def _read_batch(self) -> List[Tuple[int, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, payload FROM journal WHERE flushed_at IS NULL AND failed_at IS NULL ORDER BY seq LIMIT ?",
+                (self.batch_size,),
+            ).fetchall()
+
+    def _mark_flushed(self, seqs: List[int]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("UPDATE journal SET flushed_at = ? WHERE seq = ?", [(now, s) for s in seqs])
+                self._conn.execute(
+                    "DELETE FROM journal WHERE flushed_at IS NOT NULL AND flushed_at < ?",
+                    (now - SUBMISSION_JOURNAL_RETENTION,),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._pending -= len(seqs)
+
+    def _mark_failed(self, errors: Dict[int, str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE journal SET failed_at = ?, error = ? WHERE seq = ?",
+                [(now, error, seq) for seq, error in errors.items()],
+            )
+            self._pending -= len(errors)
+            self._dead_letters += len(errors)
+
+    # ──── Public API ────
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        """Open the journal and start the background flusher (replays unflushed entries)."""
+        if self._conn is None:
+            await asyncio.to_thread(self._open)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        if self._pending:
+            print(f"Submission journal: replaying {self._pending} unflushed submissions")
+
+    async def stop(self) -> None:
+        """Stop the flusher after a final flush."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Final submission flush failed, entries will be replayed on restart: {e}")
+            self._conn.close()
+            self._conn = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def accept(
+        self, exam_id: str, student_id: str, answers: dict, file_url: Optional[str], idempotency_key: Optional[str] = None
+    ) -> Tuple[str, bool, Optional[str]]:
+        """
+        Durably journal a submission.
+        Returns (submission_id, created, stored_idempotency_key); created is False if this
+        student already has a submission for the exam in this worker's journal.
+        """
+        if self._pending >= self.max_pending:
+            self.metrics["rejected_full"] += 1
+            raise QueueFullError("Submission queue is full, retry shortly")
+
+        row = {
+            "id": str(uuid.uuid4()),
+            "exam_id": exam_id,
+            "student_id": student_id,
+            "answers": answers,
+            "file_url": file_url,
+            "status": "submitted",
+            "idempotency_key": idempotency_key,
+        }
+        submission_id, created, stored_key = await asyncio.to_thread(
+            self._append, exam_id, student_id, idempotency_key, row
+        )
+
+        if created:
+            self.metrics["accepted"] += 1
+            self.metrics["max_pending"] = max(self.metrics["max_pending"], self._pending)
+            self._count_accept()
+            if self._pending >= self.batch_size and self._wakeup:
+                self._wakeup.set()
+        else:
+            self.metrics["duplicates"] += 1
+        return submission_id, created, stored_key
+
+    async def _write(self, entries: List[Tuple[int, dict]]) -> Tuple[List[int], Dict[int, str]]:
+        """
+        Write journal entries, halving the batch on row errors until each bad
+        row is alone. Returns (written seqs, {seq: error} for rows that failed alone).
+        Connection and server errors propagate so the whole batch is retried.
+        """
+        try:
+            stored = await self.writer([row for _, row in entries])
+        except Exception as e:
+            if not is_data_error(e):
+                raise
+            if len(entries) == 1:
+                return [], {entries[0][0]: str(e)}
+        else:
+            if stored is None:
+                return [seq for seq, _ in entries], {}
+            # Another worker or a direct-mode submit got there first: record, do not drop
+            conflicts = {seq: "conflict: the student already has a submission in Postgres"
+                         for seq, row in entries if row["id"] not in stored}
+            self.metrics["conflicts"] += len(conflicts)
+            return [seq for seq, _ in entries if seq not in conflicts], conflicts
+        mid = len(entries) // 2
+        written, failed = await self._write(entries[:mid])
+        more_written, more_failed = await self._write(entries[mid:])
+        return written + more_written, {**failed, **more_failed}
+
+    async def flush(self) -> int:
+        """Write all pending journal entries to Postgres. Returns rows flushed."""
+        flushed = 0
+        while True:
+            batch = await asyncio.to_thread(self._read_batch)
+            if not batch:
+                return flushed
+            started = time.perf_counter()
+            written, failed = await self._write([(seq, json.loads(payload)) for seq, payload in batch])
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            await asyncio.to_thread(self._mark_flushed, written)
+            if failed:
+                await asyncio.to_thread(self._mark_failed, failed)
+                self.metrics["dead_lettered"] += len(failed)
+                for seq, error in failed.items():
+                    print(f"Submission journal entry {seq} rejected by Postgres, kept as dead letter: {error}")
+
+            flushed += len(written)
+            self.metrics["flushed"] += len(written)
+            self.metrics["flush_batches"] += 1
+            self.metrics["last_flush_ms"] = round(elapsed_ms, 2)
+            self.metrics["max_flush_ms"] = round(max(self.metrics["max_flush_ms"], elapsed_ms), 2)
+
+    async def _run(self) -> None:
+        backoff = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                backoff = self.flush_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Entries stay in the journal; retry with backoff
+                self.metrics["flush_errors"] += 1
+                backoff = min(backoff * 2, 30.0)
+                print(f"Submission flush failed (retrying in {backoff:.1f}s): {e}")
+
+    # ──── Metrics ────
+
+    def _count_accept(self) -> None:
+        second = int(time.monotonic())
+        if self._accepted_window and self._accepted_window[-1][0] == second:
+            self._accepted_window[-1] = (second, self._accepted_window[-1][1] + 1)
+        else:
+            self._accepted_window.append((second, 1))
+        while self._accepted_window and self._accepted_window[0][0] < second - 60:
+            self._accepted_window.popleft()
+
+    def stats(self) -> dict:
+        """Back-pressure metrics: queue depth, throughput and flush latency."""
+        now = int(time.monotonic())
+        recent = [(s, c) for s, c in self._accepted_window if s >= now - 10]
+        return {
+            **self.metrics,
+            "enabled": True,
+            "running": self.running,
+            "pending": self._pending,
+            "dead_letters": self._dead_letters,
+            "max_pending_allowed": self.max_pending,
+            "accepted_per_second_10s": round(sum(c for _, c in recent) / 10, 2),
+            "accepted_per_second_peak": max((c for _, c in self._accepted_window), default=0),
+        }
+
+
+submission_queue: Optional[SubmissionQueue] = SubmissionQueue() if SUBMISSION_BUFFER_ENABLED else None
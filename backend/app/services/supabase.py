@@ -9,7 +9,12 @@ load_dotenv()
 # No hardcoded IP overrides needed here – the universal IPv4 filter is safer.
 # ---------------------------------------------------------------------------
 
-from supabase import create_client, Client
+import copy
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+from supabase import create_client, Client, acreate_client, AsyncClient
+
+T = TypeVar("T")
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -30,13 +35,20 @@ except Exception:
 # ---------------------------------------------------------------------------
 _supabase_client: Client = None
 _supabase_admin_client: Client = None
+_async_supabase_client: AsyncClient = None
+_async_supabase_admin_client: AsyncClient = None
+_async_clients_loop = None
 
 
 def reset_clients():
     """Reset all cached clients so next call creates fresh connections."""
     global _supabase_client, _supabase_admin_client
+    global _async_supabase_client, _async_supabase_admin_client, _async_clients_loop
     _supabase_client = None
     _supabase_admin_client = None
+    _async_supabase_client = None
+    _async_supabase_admin_client = None
+    _async_clients_loop = None
 
 
 def get_supabase() -> Client:
@@ -55,3 +67,134 @@ def get_supabase_admin() -> Client:
             raise ValueError("SUPABASE_SERVICE_KEY must be set for admin operations")
         _supabase_admin_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
     return _supabase_admin_client
+
+
+# ---------------------------------------------------------------------------
+# Async clients – used by request handlers so PostgREST / Auth / Storage
+# calls never block the event loop. Connection pools are bound to the loop
+# that created them, so they are rebuilt if the running loop changes.
+# ---------------------------------------------------------------------------
+
+def _check_async_loop():
+    global _async_supabase_client, _async_supabase_admin_client, _async_clients_loop
+    loop = asyncio.get_running_loop()
+    if _async_clients_loop is not loop:
+        _async_supabase_client = None
+        _async_supabase_admin_client = None
+        _async_clients_loop = loop
+
+
+async def get_async_supabase() -> AsyncClient:
+    """Get the regular async Supabase client."""
+    global _async_supabase_client
+    _check_async_loop()
+    if _async_supabase_client is None:
+        _async_supabase_client = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+    return _async_supabase_client
+
+
+async def get_async_supabase_admin() -> AsyncClient:
+    """Get the admin async Supabase client (bypasses RLS)."""
+    global _async_supabase_admin_client
+    _check_async_loop()
+    if _async_supabase_admin_client is None:
+        if not SUPABASE_SERVICE_KEY:
+            raise ValueError("SUPABASE_SERVICE_KEY must be set for admin operations")
+        _async_supabase_admin_client = await acreate_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    return _async_supabase_admin_client
+
+
+def is_data_error(e: Exception) -> bool:
+    """
+    True for Postgres data / constraint errors (SQLSTATE 22xxx, 23xxx): caused by
+    the rows sent, so retrying them unchanged cannot succeed.
+    """
+    code = getattr(e, "code", None)
+    return isinstance(code, str) and code[:2] in ("22", "23")
+
+
+# ---------------------------------------------------------------------------
+# Single-flight reads: concurrent callers asking for the same key share one
+# in-flight request. Only in-flight calls are shared, so nothing gets staler.
+# Every caller that joined an in-flight request receives its own deep copy,
+# so handlers may mutate results freely.
+# ---------------------------------------------------------------------------
+
+class _Flight:
+    __slots__ = ("future", "waiters")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+
+
+_flights: Dict[Hashable, _Flight] = {}
+_flights_loop = None
+_flight_stats = {"executed": 0, "coalesced": 0, "errors": 0}
+_flight_stats_by_name: Dict[str, Dict[str, int]] = {}
+
+
+def _count_flight(key: Hashable, field: str) -> None:
+    _flight_stats[field] += 1
+    name = str(key[0] if isinstance(key, tuple) and key else key)
+    bucket = _flight_stats_by_name.setdefault(name, {"executed": 0, "coalesced": 0})
+    if field in bucket:
+        bucket[field] += 1
+
+
+async def coalesced(key: Hashable, fetch: Callable[[], Awaitable[T]], copy_result: bool = True) -> T:
+    """
+    Run `fetch()` unless an identical call (same key) is already in flight, in
+    which case wait for and share its result. The key must capture everything
+    that affects the response (table, columns, filters, paging). Pass
+    copy_result=False for results that are never mutated.
+    """
+    global _flights, _flights_loop
+    loop = asyncio.get_running_loop()
+    if _flights_loop is not loop:
+        _flights, _flights_loop = {}, loop
+
+    flight = _flights.get(key)
+    if flight is not None:
+        _count_flight(key, "coalesced")
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.future)
+        except asyncio.CancelledError:
+            if flight.future.cancelled():
+                # The leading request was cancelled (client went away): fetch ourselves
+                return await coalesced(key, fetch, copy_result)
+            raise
+        return copy.deepcopy(result) if copy_result else result
+
+    flight = _Flight(loop.create_future())
+    _flights[key] = flight
+    _count_flight(key, "executed")
+    try:
+        result = await fetch()
+    except asyncio.CancelledError:
+        flight.future.cancel()
+        raise
+    except Exception as e:
+        _flight_stats["errors"] += 1
+        flight.future.set_exception(e)
+        flight.future.exception()  # mark retrieved when nobody was waiting
+        raise
+    finally:
+        if _flights.get(key) is flight:
+            del _flights[key]
+
+    flight.future.set_result(result)
+    # Waiters copy from the shared object after we return; give our caller its own
+    return copy.deepcopy(result) if copy_result and flight.waiters else result
+
+
+def get_coalescing_stats() -> dict:
+    """Single-flight counters: requests executed vs. served from an in-flight twin."""
+    total = _flight_stats["executed"] + _flight_stats["coalesced"]
+    return {
+        **_flight_stats,
+        "in_flight": len(_flights),
+        "coalesced_ratio": round(_flight_stats["coalesced"] / total, 4) if total else None,
+        "by_name": {k: dict(v) for k, v in _flight_stats_by_name.items()},
+    }
@@ -0,0 +1,164 @@
+"""
+Token Verifier
+In-process verification of Supabase access tokens (project JWT secret or cached JWKS),
+with a remote Supabase Auth fallback for unknown signing keys and strict mode.
+"""
+
+import os
+import time
+import asyncio
+import httpx
+from jose import jwt, JWTError
+from app.services.supabase import SUPABASE_URL, get_async_supabase
+
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET") or os.getenv("JWT_SECRET")
+JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+JWT_ISSUER = os.getenv("SUPABASE_JWT_ISSUER", f"{SUPABASE_URL.rstrip('/')}/auth/v1")
+JWKS_URL = f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json"
+JWKS_CACHE_TTL = int(os.getenv("JWKS_CACHE_TTL", "600"))
+JWKS_MIN_REFRESH_INTERVAL = 30
+
+# Strict mode: always confirm the token with Supabase Auth (e.g. to honour
+# sign-outs / revoked sessions before the access token expires).
+AUTH_STRICT_MODE = os.getenv("AUTH_STRICT_MODE", "false").lower() in ("1", "true", "yes")
+
+ALLOWED_ALGORITHMS = {"HS256", "RS256", "ES256"}
+
+
+class InvalidTokenError(Exception):
+    """Raised when a token is malformed, badly signed, expired or for another audience."""
+
+
+class _RemoteCheckRequired(Exception):
+    """Internal signal: the token cannot be verified locally."""
+
+
+# ---------------------------------------------------------------------------
+# JWKS cache (asymmetric signing keys)
+# ---------------------------------------------------------------------------
+_jwks_keys: dict = {}
+_jwks_fetched_at: float = 0.0
+_jwks_lock = asyncio.Lock()
+
+
+async def _refresh_jwks(force: bool = False) -> None:
+    """Fetch the project's JWKS document, at most once per refresh interval."""
+    global _jwks_keys, _jwks_fetched_at
+    async with _jwks_lock:
+        age = time.monotonic() - _jwks_fetched_at
+        if _jwks_fetched_at and age < (JWKS_MIN_REFRESH_INTERVAL if force else JWKS_CACHE_TTL):
+            return
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                resp = await client.get(JWKS_URL)
+                resp.raise_for_status()
+                keys = resp.json().get("keys", [])
+            _jwks_keys = {k["kid"]: k for k in keys if k.get("kid")}
+        except Exception as e:
+            print(f"Failed to refresh JWKS from {JWKS_URL}: {e}")
+        _jwks_fetched_at = time.monotonic()
+
+
+async def _signing_key(header: dict):
+    """Resolve the verification key for a token header."""
+    alg = header.get("alg")
+    if alg not in ALLOWED_ALGORITHMS:
+        raise InvalidTokenError(f"Unsupported token algorithm: {alg}")
+
+    if alg == "HS256":
+        if not SUPABASE_JWT_SECRET:
+            raise _RemoteCheckRequired()
+        return SUPABASE_JWT_SECRET
+
+    kid = header.get("kid")
+    if not kid:
+        raise _RemoteCheckRequired()
+    await _refresh_jwks()
+    if kid not in _jwks_keys:
+        # Key rotation: refetch once, then defer to Supabase Auth
+        await _refresh_jwks(force=True)
+    if kid not in _jwks_keys:
+        raise _RemoteCheckRequired()
+    return _jwks_keys[kid]
+
+
+# ---------------------------------------------------------------------------
+# Verification timing stats
+# ---------------------------------------------------------------------------
+_stats = {
+    "local": {"count": 0, "total_ms": 0.0, "max_ms": 0.0},
+    "remote": {"count": 0, "total_ms": 0.0, "max_ms": 0.0},
+    "rejected": 0,
+}
+
+
+def _record(method: str, started: float) -> None:
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    bucket = _stats[method]
+    bucket["count"] += 1
+    bucket["total_ms"] += elapsed_ms
+    bucket["max_ms"] = max(bucket["max_ms"], elapsed_ms)
+
+
+def get_verification_stats() -> dict:
+    """Return verification counts and latencies (ms) per method."""
+    stats = {"strict_mode": AUTH_STRICT_MODE, "rejected": _stats["rejected"]}
+    for method in ("local", "remote"):
+        bucket = _stats[method]
+        stats[method] = {
+            "count": bucket["count"],
+            "avg_ms": round(bucket["total_ms"] / bucket["count"], 3) if bucket["count"] else None,
+            "max_ms": round(bucket["max_ms"], 3),
+        }
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+async def _verify_remote(token: str) -> str:
+    """Verify the token with Supabase Auth and return the user id."""
+    started = time.perf_counter()
+    try:
+        sb = await get_async_supabase()
+        user_response = await sb.auth.get_user(token)
+    finally:
+        _record("remote", started)
+    if not user_response or not user_response.user:
+        raise InvalidTokenError("Invalid or expired token")
+    return user_response.user.id
+
+
+async def verify_access_token(token: str) -> str:
+    """
+    Verify a Supabase access token and return the authenticated user id.
+    Raises InvalidTokenError if the token is not acceptable.
+    """
+    if AUTH_STRICT_MODE:
+        return await _verify_remote(token)
+
+    started = time.perf_counter()
+    try:
+        header = jwt.get_unverified_header(token)
+        key = await _signing_key(header)
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=[header["alg"]],
+            audience=JWT_AUDIENCE,
+            issuer=JWT_ISSUER,
+        )
+    except _RemoteCheckRequired:
+        return await _verify_remote(token)
+    except (JWTError, InvalidTokenError) as e:
+        _record("local", started)
+        _stats["rejected"] += 1
+        raise InvalidTokenError(str(e))
+    _record("local", started)
+
+    user_id = claims.get("sub")
+    if not user_id:
+        _stats["rejected"] += 1
+        raise InvalidTokenError("Token has no subject")
+    return user_id
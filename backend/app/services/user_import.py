@@ -0,0 +1,219 @@
+"""
+Bulk User Import
+Provisions accounts from an uploaded CSV or JSONL file: rows are validated with
+UserRegister, Auth users are created with bounded concurrency and profiles are
+written in multi-row batches. Re-running an import skips accounts that already
+have a profile and adopts Auth users left behind by an interrupted run.
+Emails are compared case-insensitively throughout.
+"""
+
+import os
+import csv
+import json
+import codecs
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from fastapi import UploadFile
+from pydantic import ValidationError
+from app.models.schemas import UserRegister
+from app.services.supabase import get_async_supabase_admin
+from app.services.pagination import ilike_in
+
+USER_IMPORT_CONCURRENCY = int(os.getenv("USER_IMPORT_CONCURRENCY", "8"))
+USER_IMPORT_BATCH_SIZE = int(os.getenv("USER_IMPORT_BATCH_SIZE", "200"))
+USER_IMPORT_MAX_ROWS = int(os.getenv("USER_IMPORT_MAX_ROWS", "10000"))
+_READ_CHUNK = 64 * 1024
+_AUTH_PAGE_SIZE = 1000
+
+
+async def _lines(upload: UploadFile) -> AsyncIterator[str]:
+    """Decode the upload incrementally, yielding lines with their endings."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    while True:
+        chunk = await upload.read(_READ_CHUNK)
+        buffer += decoder.decode(chunk, final=not chunk)
+        lines = buffer.splitlines(keepends=True)
+        if chunk and lines and not lines[-1].endswith(("\n", "\r")):
+            buffer = lines.pop()
+        else:
+            buffer = ""
+        for line in lines:
+            yield line
+        if not chunk:
+            return
+
+
+async def _records(upload: UploadFile, fmt: str) -> AsyncIterator[Tuple[int, dict]]:
+    """(row number, raw record) pairs; CSV row numbers count the header as row 1."""
+    if fmt == "jsonl":
+        number = 0
+        async for line in _lines(upload):
+            number += 1
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    record = {"__error__": f"Invalid JSON: {e}"}
+                yield number, record if isinstance(record, dict) else {"__error__": "Expected a JSON object"}
+        return
+
+    header: Optional[List[str]] = None
+    pending = ""  # CSV records may span lines inside quoted fields
+    number = 0
+    async for line in _lines(upload):
+        number += 1
+        pending += line
+        if pending.count('"') % 2:
+            continue
+        values = next(csv.reader([pending]), [])
+        pending = ""
+        if not any(v.strip() for v in values):
+            continue
+        if header is None:
+            header = [h.strip().lower() for h in values]
+            continue
+        yield number, {k: v.strip() for k, v in zip(header, values) if v.strip()}
+
+
+def _profile_row(user_id: str, user: UserRegister) -> dict:
+    return {
+        "id": user_id,
+        "email": user.email,
+        "full_name": user.full_name,
+        "role": user.role.value,
+        "gender": user.gender.value,
+        "department": user.department,
+        "reg_number": user.reg_number,
+    }
+
+
+class UserImport:
+    """One import run. Call run() with the uploaded file, then read report()."""
+
+    def __init__(self, concurrency: int = USER_IMPORT_CONCURRENCY, batch_size: int = USER_IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._auth_ids: Optional[Dict[str, str]] = None  # email → id of existing Auth users, loaded on demand
+        self._auth_ids_lock = asyncio.Lock()
+        self.total = 0
+        self.created = 0
+        self.adopted = 0
+        self.skipped = 0
+        self.truncated = False
+        self.failures: List[dict] = []
+
+    def _fail(self, row: int, email: Optional[str], error: str) -> None:
+        self.failures.append({"row": row, "email": email, "error": error})
+
+    async def run(self, upload: UploadFile, fmt: str) -> dict:
+        batch: List[Tuple[int, UserRegister]] = []
+        seen = set()
+        async for number, record in _records(upload, fmt):
+            if self.total >= USER_IMPORT_MAX_ROWS:
+                # Earlier batches are already created: stop here and report them
+                self.truncated = True
+                self._fail(number, None, f"Import truncated at {USER_IMPORT_MAX_ROWS} rows; this and later rows were not read")
+                break
+            self.total += 1
+            if "__error__" in record:
+                self._fail(number, None, record["__error__"])
+                continue
+            try:
+                user = UserRegister(**record)
+            except ValidationError as e:
+                errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                self._fail(number, record.get("email"), errors)
+                continue
+            email = user.email.lower()
+            if email in seen:
+                self._fail(number, user.email, "Duplicate email in file")
+                continue
+            seen.add(email)
+            batch.append((number, user))
+            if len(batch) >= self.batch_size:
+                await self._process(batch)
+                batch = []
+        if batch:
+            await self._process(batch)
+        return self.report()
+
+    async def _process(self, batch: List[Tuple[int, UserRegister]]) -> None:
+        sb = await get_async_supabase_admin()
+
+        # Resume: accounts that already have a profile are done
+        existing = await sb.table("profiles").select("email").or_(ilike_in("email", [u.email for _, u in batch])).execute()
+        done = {r["email"].lower() for r in (existing.data or [])}
+        todo = [(n, u) for n, u in batch if u.email.lower() not in done]
+        self.skipped += len(batch) - len(todo)
+
+        user_ids = await asyncio.gather(*(self._create_auth_user(n, u) for n, u in todo))
+        created = [(n, u, uid) for (n, u), uid in zip(todo, user_ids) if uid]
+        if created:
+            await self._insert_profiles(sb, created)
+
+    async def _create_auth_user(self, number: int, user: UserRegister) -> Optional[str]:
+        async with self._semaphore:
+            sb = await get_async_supabase_admin()
+            try:
+                response = await sb.auth.admin.create_user({
+                    "email": user.email,
+                    "password": user.password,
+                    "email_confirm": True,
+                })
+                if response and response.user:
+                    return response.user.id
+                self._fail(number, user.email, "Failed to create user")
+            except Exception as e:
+                if "already" in str(e).lower():
+                    # Left behind by an interrupted import: reuse it
+                    user_id = (await self._existing_auth_ids()).get(user.email.lower())
+                    if user_id:
+                        self.adopted += 1
+                        return user_id
+                self._fail(number, user.email, str(e))
+            return None
+
+    async def _existing_auth_ids(self) -> Dict[str, str]:
+        async with self._auth_ids_lock:
+            if self._auth_ids is None:
+                sb = await get_async_supabase_admin()
+                ids, page = {}, 1
+                while True:
+                    users = await sb.auth.admin.list_users(page=page, per_page=_AUTH_PAGE_SIZE)
+                    for u in users:
+                        if u.email:
+                            ids[u.email.lower()] = u.id
+                    if len(users) < _AUTH_PAGE_SIZE:
+                        break
+                    page += 1
+                self._auth_ids = ids
+            return self._auth_ids
+
+    async def _insert_profiles(self, sb, created: List[Tuple[int, UserRegister, str]]) -> None:
+        rows = [_profile_row(uid, u) for _, u, uid in created]
+        try:
+            await sb.table("profiles").upsert(rows, on_conflict="id", ignore_duplicates=True, returning="minimal").execute()
+            self.created += len(rows)
+            return
+        except Exception as e:
+            print(f"User import: batch profile insert failed, retrying rows individually: {e}")
+
+        # Isolate the failing rows
+        for (number, user, uid), row in zip(created, rows):
+            try:
+                await sb.table("profiles").upsert(row, on_conflict="id", ignore_duplicates=True, returning="minimal").execute()
+                self.created += 1
+            except Exception as e:
+                self._fail(number, user.email, f"Profile insert failed: {e}")
+
+    def report(self) -> dict:
+        return {
+            "total_rows": self.total,
+            "created": self.created,
+            "adopted_auth_users": self.adopted,
+            "skipped_existing": self.skipped,
+            "truncated": self.truncated,
+            "failed": len(self.failures),
+            "failures": sorted(self.failures, key=lambda f: f["row"]),
+        }
@@ -0,0 +1,58 @@
+"""
+Auto-Grading Benchmark
+CPU time of the MCQ grading engine on a synthetic exam:
+
+    python benchmarks/auto_grade.py --students 1000 --questions 100
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The grading module imports the Supabase service; no connection is made here
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+
+from app.services.grading import AnswerKey, DEFAULT_SCALE, percentages_for
+
+
+def main(students: int, questions: int, seed: int) -> None:
+    rng = random.Random(seed)
+    options = ["Option A", "Option B", "Option C", "Option D"]
+    question_rows = [
+        {
+            "id": f"q{i}",
+            "question_type": "mcq",
+            "options": json.dumps(options),
+            "correct_answer": rng.choice(options),
+            "marks": 1,
+        }
+        for i in range(questions)
+    ]
+    answer_sets = [
+        {f"q{i}": rng.choice(options + [None]) for i in range(questions)}
+        for _ in range(students)
+    ]
+
+    started = time.process_time()
+    key = AnswerKey(question_rows)
+    matrix = key.encode(answer_sets)
+    marks = key.score(matrix)
+    grades = DEFAULT_SCALE.grade_many(percentages_for(marks, questions))
+    elapsed_ms = (time.process_time() - started) * 1000
+
+    print(f"{students} students x {questions} questions: {elapsed_ms:.1f} ms CPU "
+          f"(mean score {marks.mean():.1f}, {grades.count('F')} F grades)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    main(args.students, args.questions, args.seed)
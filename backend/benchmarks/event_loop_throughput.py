@@ -0,0 +1,114 @@
+"""
+Event Loop Throughput Benchmark
+Compares concurrent-request throughput of one worker when handlers use the
+synchronous supabase client (before) vs the async data-access layer (after).
+
+A local stand-in for PostgREST answers every query after a fixed latency, so
+no Supabase project is needed:
+
+    python benchmarks/event_loop_throughput.py --requests 200 --concurrency 50 --latency-ms 50
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _serve_fake_postgrest(latency: float, port_queue) -> None:
+    """Answer every HTTP request with `[]` after `latency` seconds (keep-alive)."""
+    body = b"[]"
+    response = (
+        b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+        b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+    )
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                await asyncio.sleep(latency)
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=1024)
+        port_queue.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_fake_postgrest(latency: float):
+    """Run the stand-in server in its own process so it does not share our GIL."""
+    port_queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_serve_fake_postgrest, args=(latency, port_queue), daemon=True)
+    proc.start()
+    return proc, port_queue.get(timeout=10)
+
+
+async def run(requests: int, concurrency: int, latency_ms: int) -> None:
+    server, port = start_fake_postgrest(latency_ms / 1000)
+    os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("SUPABASE_KEY", "bench")
+    os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench")
+
+    import httpx
+    from fastapi import FastAPI
+    from app.services.supabase import get_supabase_admin, get_async_supabase_admin
+
+    app = FastAPI()
+
+    @app.get("/before")
+    async def before():
+        # Pre-change pattern: sync client inside an async handler
+        result = get_supabase_admin().table("exams").select("*").execute()
+        return result.data
+
+    @app.get("/after")
+    async def after():
+        sb = await get_async_supabase_admin()
+        result = await sb.table("exams").select("*").execute()
+        return result.data
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path in ("/before", "/after"):
+            await client.get(path)  # warm up clients
+            sem = asyncio.Semaphore(concurrency)
+
+            async def one():
+                async with sem:
+                    resp = await client.get(path)
+                    resp.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(requests)))
+            elapsed = time.perf_counter() - started
+            print(f"{path:8s} {requests} requests, concurrency {concurrency}: "
+                  f"{elapsed:.2f}s  ({requests / elapsed:.1f} req/s)")
+
+    server.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.concurrency, args.latency_ms))
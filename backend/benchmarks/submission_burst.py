@@ -0,0 +1,74 @@
+"""
+Submission Burst Benchmark
+Fires a burst of concurrent submissions at the write-behind queue, with a
+simulated PostgREST insert latency per flushed batch, and reports how fast
+submissions are acknowledged while the flusher drains the journal:
+
+    python benchmarks/submission_burst.py --submissions 2000 --insert-latency-ms 80
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The queue module imports the Supabase service; no connection is made here
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+
+from app.services.submission_queue import SubmissionQueue
+
+
+async def run(submissions: int, insert_latency_ms: int, batch_size: int) -> None:
+    flushed_batches = []
+
+    async def fake_insert(rows):
+        await asyncio.sleep(insert_latency_ms / 1000)
+        flushed_batches.append(len(rows))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SubmissionQueue(
+            directory=tmp,
+            writer=fake_insert,
+            flush_interval=0.1,
+            batch_size=batch_size,
+        )
+        await queue.start()
+
+        answers = {f"q{i}": "Option B" for i in range(40)}
+        ack_times = []
+        started = time.perf_counter()
+
+        async def submit(i: int):
+            await queue.accept("exam-1", f"student-{i}", answers, f"https://files/answers/{i}.pdf")
+            ack_times.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(submit(i) for i in range(submissions)))
+        accepted_in = time.perf_counter() - started
+        while queue.stats()["pending"]:
+            await asyncio.sleep(0.01)
+        drained_in = time.perf_counter() - started
+        await queue.stop()
+
+    # Acknowledgements per 100 ms bucket – flat buckets mean no stall behind the flusher
+    buckets = {}
+    for t in ack_times:
+        buckets[int(t * 10)] = buckets.get(int(t * 10), 0) + 1
+    rates = [buckets.get(b, 0) * 10 for b in range(max(buckets) + 1)]
+
+    print(f"{submissions} submissions acknowledged in {accepted_in:.2f}s "
+          f"({submissions / accepted_in:.0f}/s); journal drained in {drained_in:.2f}s")
+    print(f"accepted/s per 100 ms window: {rates}")
+    print(f"flushed in {len(flushed_batches)} batches (largest {max(flushed_batches)})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=2000)
+    parser.add_argument("--insert-latency-ms", type=int, default=80)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.submissions, args.insert_latency_ms, args.batch_size))
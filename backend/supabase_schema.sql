@@ -4,6 +4,9 @@
 -- Run this in Supabase SQL Editor
 -- ====================================================
 
+-- Trigram indexes for user search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Profiles table (linked to Supabase Auth)
 CREATE TABLE IF NOT EXISTS profiles (
     id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
@@ -29,6 +32,7 @@ CREATE TABLE IF NOT EXISTS exams (
     status TEXT DEFAULT 'draft' CHECK (status IN ('draft', 'scheduled', 'active', 'completed', 'results_published')),
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
+ALTER TABLE exams ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
 
 -- Questions table
 CREATE TABLE IF NOT EXISTS questions (
@@ -53,6 +57,7 @@ CREATE TABLE IF NOT EXISTS submissions (
     status TEXT DEFAULT 'submitted' CHECK (status IN ('submitted', 'evaluated')),
     UNIQUE(exam_id, student_id)
 );
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
 
 -- Results table
 CREATE TABLE IF NOT EXISTS results (
@@ -70,6 +75,49 @@ CREATE TABLE IF NOT EXISTS results (
     evaluated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Autosaved answers for in-progress exams (one row per student per exam)
+CREATE TABLE IF NOT EXISTS submission_drafts (
+    exam_id UUID NOT NULL REFERENCES exams(id) ON DELETE CASCADE,
+    student_id UUID NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    answers JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (exam_id, student_id)
+);
+
+-- Grading scales: per-exam override or per-department ladder
+-- bands: [{"min_percentage": 90, "grade": "A+"}, ...] (must include 0)
+CREATE TABLE IF NOT EXISTS grading_scales (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    exam_id UUID UNIQUE REFERENCES exams(id) ON DELETE CASCADE,
+    department TEXT UNIQUE,
+    bands JSONB NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    CHECK ((exam_id IS NULL) <> (department IS NULL))
+);
+
+-- Per-student aggregates over published results (maintained by publish_exam_results)
+-- subjects: {"<subject>": {"count", "sum", "best", "worst", "average"}}
+CREATE TABLE IF NOT EXISTS student_performance (
+    student_id UUID PRIMARY KEY REFERENCES profiles(id) ON DELETE CASCADE,
+    results_count INT NOT NULL DEFAULT 0,
+    percentage_sum NUMERIC NOT NULL DEFAULT 0,
+    average_percentage NUMERIC GENERATED ALWAYS AS (
+        CASE WHEN results_count > 0 THEN ROUND(percentage_sum / results_count, 2) END
+    ) STORED,
+    best_percentage DECIMAL(5,2),
+    worst_percentage DECIMAL(5,2),
+    subjects JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Single-runner locks for background jobs (lease expires if a runner dies)
+CREATE TABLE IF NOT EXISTS job_locks (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    locked_until TIMESTAMPTZ NOT NULL,
+    acquired_at TIMESTAMPTZ DEFAULT NOW()
+);
+
 -- ====================================================
 -- Realtime & Communication Tables
 -- ====================================================
@@ -99,13 +147,316 @@ CREATE TABLE IF NOT EXISTS live_classes (
 CREATE INDEX IF NOT EXISTS idx_profiles_role ON profiles(role);
 CREATE INDEX IF NOT EXISTS idx_exams_teacher ON exams(teacher_id);
 CREATE INDEX IF NOT EXISTS idx_exams_status ON exams(status);
+CREATE INDEX IF NOT EXISTS idx_exams_status_schedule ON exams(status, scheduled_at, id);
+CREATE INDEX IF NOT EXISTS idx_exams_updated_at ON exams(updated_at);
+CREATE INDEX IF NOT EXISTS idx_profiles_department ON profiles(department);
+CREATE INDEX IF NOT EXISTS idx_profiles_created_keyset ON profiles(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_profiles_role_created_keyset ON profiles(role, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_profiles_reg_number_prefix ON profiles(reg_number text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_profiles_full_name_trgm ON profiles USING gin (full_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_profiles_email_trgm ON profiles USING gin (email gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_questions_exam ON questions(exam_id);
 CREATE INDEX IF NOT EXISTS idx_submissions_exam ON submissions(exam_id);
 CREATE INDEX IF NOT EXISTS idx_submissions_student ON submissions(student_id);
+CREATE INDEX IF NOT EXISTS idx_submissions_exam_keyset ON submissions(exam_id, submitted_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_submissions_file_cleanup ON submissions(submitted_at, id) WHERE file_url IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_results_exam ON results(exam_id);
 CREATE INDEX IF NOT EXISTS idx_results_student ON results(student_id);
+CREATE INDEX IF NOT EXISTS idx_results_student_keyset ON results(student_id, id);
+CREATE INDEX IF NOT EXISTS idx_results_exam_student_keyset ON results(exam_id, student_id, id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_results_submission ON results(submission_id);
 CREATE INDEX IF NOT EXISTS idx_results_published ON results(published);
 
+-- ====================================================
+-- Aggregate functions (called via PostgREST rpc, service role only)
+-- ====================================================
+
+-- Teacher dashboard: submission totals across all of a teacher's exams
+CREATE OR REPLACE FUNCTION teacher_submission_stats(p_teacher_id UUID)
+RETURNS TABLE (total_submissions BIGINT, pending_evaluations BIGINT)
+LANGUAGE sql STABLE AS $$
+    SELECT COUNT(*) AS total_submissions,
+           COUNT(*) FILTER (WHERE s.status = 'submitted') AS pending_evaluations
+    FROM submissions s
+    JOIN exams e ON e.id = s.exam_id
+    WHERE e.teacher_id = p_teacher_id;
+$$;
+REVOKE EXECUTE ON FUNCTION teacher_submission_stats(UUID) FROM PUBLIC, anon, authenticated;
+
+-- Student submit: validates exam status and inserts atomically.
+-- UNIQUE(exam_id, student_id) resolves concurrent / retried submits; a
+-- conflicting row is returned with created = FALSE.
+CREATE OR REPLACE FUNCTION submit_exam(
+    p_exam_id UUID,
+    p_student_id UUID,
+    p_answers JSONB,
+    p_file_url TEXT,
+    p_idempotency_key TEXT DEFAULT NULL
+)
+RETURNS TABLE (submission_id UUID, created BOOLEAN, idempotency_key TEXT, exam_status TEXT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+    v_status TEXT;
+    v_id UUID;
+BEGIN
+    SELECT e.status INTO v_status FROM exams e WHERE e.id = p_exam_id;
+    IF v_status IS NULL OR v_status NOT IN ('scheduled', 'active') THEN
+        RETURN QUERY SELECT NULL::UUID, FALSE, NULL::TEXT, v_status;
+        RETURN;
+    END IF;
+
+    INSERT INTO submissions (exam_id, student_id, answers, file_url, status, idempotency_key)
+    VALUES (p_exam_id, p_student_id, COALESCE(p_answers, '{}'::jsonb), p_file_url, 'submitted', p_idempotency_key)
+    ON CONFLICT (exam_id, student_id) DO NOTHING
+    RETURNING id INTO v_id;
+
+    IF v_id IS NOT NULL THEN
+        RETURN QUERY SELECT v_id, TRUE, p_idempotency_key, v_status;
+    ELSE
+        RETURN QUERY SELECT s.id, FALSE, s.idempotency_key, v_status
+        FROM submissions s WHERE s.exam_id = p_exam_id AND s.student_id = p_student_id;
+    END IF;
+END;
+$$;
+REVOKE EXECUTE ON FUNCTION submit_exam(UUID, UUID, JSONB, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+
+-- Autosave: apply coalesced per-question deltas for many drafts at once.
+-- p_deltas: [{"exam_id", "student_id", "set": {qid: answer}, "unset": [qid]}]
+CREATE OR REPLACE FUNCTION merge_submission_drafts(p_deltas JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    d JSONB;
+    v_set JSONB;
+    v_unset TEXT[];
+    n INTEGER := 0;
+BEGIN
+    FOR d IN SELECT * FROM jsonb_array_elements(p_deltas) LOOP
+        v_set := COALESCE(d->'set', '{}'::jsonb);
+        v_unset := ARRAY(SELECT jsonb_array_elements_text(COALESCE(d->'unset', '[]'::jsonb)));
+
+        INSERT INTO submission_drafts AS sd (exam_id, student_id, answers, updated_at)
+        VALUES ((d->>'exam_id')::uuid, (d->>'student_id')::uuid, v_set, NOW())
+        ON CONFLICT (exam_id, student_id) DO UPDATE
+        SET answers = (sd.answers - v_unset) || v_set,
+            updated_at = NOW();
+        n := n + 1;
+    END LOOP;
+    RETURN n;
+END;
+$$;
+REVOKE EXECUTE ON FUNCTION merge_submission_drafts(JSONB) FROM PUBLIC, anon, authenticated;
+
+-- Job locks: take (or renew) a lease; returns FALSE while another holder has it
+CREATE OR REPLACE FUNCTION try_acquire_job_lock(p_name TEXT, p_holder TEXT, p_ttl_seconds INTEGER)
+RETURNS BOOLEAN
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_holder TEXT;
+BEGIN
+    INSERT INTO job_locks AS jl (name, holder, locked_until, acquired_at)
+    VALUES (p_name, p_holder, NOW() + make_interval(secs => p_ttl_seconds), NOW())
+    ON CONFLICT (name) DO UPDATE
+    SET holder = EXCLUDED.holder,
+        locked_until = EXCLUDED.locked_until,
+        acquired_at = EXCLUDED.acquired_at
+    WHERE jl.locked_until < NOW() OR jl.holder = EXCLUDED.holder
+    RETURNING holder INTO v_holder;
+    RETURN v_holder IS NOT NULL;
+END;
+$$;
+REVOKE EXECUTE ON FUNCTION try_acquire_job_lock(TEXT, TEXT, INTEGER) FROM PUBLIC, anon, authenticated;
+
+CREATE OR REPLACE FUNCTION release_job_lock(p_name TEXT, p_holder TEXT)
+RETURNS VOID
+LANGUAGE sql AS $$
+    DELETE FROM job_locks WHERE name = p_name AND holder = p_holder;
+$$;
+REVOKE EXECUTE ON FUNCTION release_job_lock(TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+
+-- Exam lifecycle: keep exams.updated_at current for incremental refreshes
+CREATE OR REPLACE FUNCTION touch_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS exams_touch_updated_at ON exams;
+CREATE TRIGGER exams_touch_updated_at
+    BEFORE UPDATE ON exams
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+-- Exam lifecycle: apply every due transition in one statement.
+-- scheduled → active at scheduled_at; scheduled/active → completed once the
+-- exam has ended plus the submission grace period.
+CREATE OR REPLACE FUNCTION advance_exam_statuses(p_grace_seconds INTEGER DEFAULT 0)
+RETURNS TABLE (id UUID, status TEXT, scheduled_at TIMESTAMPTZ, duration_minutes INT)
+LANGUAGE sql AS $$
+    WITH completed AS (
+        UPDATE exams e SET status = 'completed'
+        WHERE e.status IN ('scheduled', 'active')
+          AND e.scheduled_at + make_interval(mins => e.duration_minutes, secs => p_grace_seconds) <= NOW()
+        RETURNING e.id, e.status, e.scheduled_at, e.duration_minutes
+    ), activated AS (
+        UPDATE exams e SET status = 'active'
+        WHERE e.status = 'scheduled'
+          AND e.scheduled_at <= NOW()
+          AND e.scheduled_at + make_interval(mins => e.duration_minutes, secs => p_grace_seconds) > NOW()
+        RETURNING e.id, e.status, e.scheduled_at, e.duration_minutes
+    )
+    SELECT * FROM completed
+    UNION ALL
+    SELECT * FROM activated;
+$$;
+REVOKE EXECUTE ON FUNCTION advance_exam_statuses(INTEGER) FROM PUBLIC, anon, authenticated;
+
+-- Student performance: recompute the aggregates of the given students (all when NULL)
+-- with one grouped upsert over their published results.
+CREATE OR REPLACE FUNCTION refresh_student_performance(p_student_ids UUID[] DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    n INTEGER;
+BEGIN
+    INSERT INTO student_performance AS sp
+        (student_id, results_count, percentage_sum, best_percentage, worst_percentage, subjects, updated_at)
+    SELECT s.student_id, SUM(s.cnt), SUM(s.total), MAX(s.best), MIN(s.worst),
+           jsonb_object_agg(s.subject, jsonb_build_object(
+               'count', s.cnt, 'sum', s.total, 'best', s.best, 'worst', s.worst,
+               'average', ROUND(s.total / s.cnt, 2)
+           )),
+           NOW()
+    FROM (
+        SELECT r.student_id, e.subject, COUNT(*) AS cnt, SUM(r.percentage) AS total,
+               MAX(r.percentage) AS best, MIN(r.percentage) AS worst
+        FROM results r
+        JOIN exams e ON e.id = r.exam_id
+        WHERE r.published AND r.percentage IS NOT NULL
+          AND (p_student_ids IS NULL OR r.student_id = ANY(p_student_ids))
+        GROUP BY r.student_id, e.subject
+    ) s
+    GROUP BY s.student_id
+    ON CONFLICT (student_id) DO UPDATE
+    SET results_count = EXCLUDED.results_count,
+        percentage_sum = EXCLUDED.percentage_sum,
+        best_percentage = EXCLUDED.best_percentage,
+        worst_percentage = EXCLUDED.worst_percentage,
+        subjects = EXCLUDED.subjects,
+        updated_at = EXCLUDED.updated_at;
+    GET DIAGNOSTICS n = ROW_COUNT;
+
+    -- Students left without published results
+    DELETE FROM student_performance sp
+    WHERE (p_student_ids IS NULL OR sp.student_id = ANY(p_student_ids))
+      AND NOT EXISTS (
+          SELECT 1 FROM results r
+          WHERE r.student_id = sp.student_id AND r.published AND r.percentage IS NOT NULL
+      );
+    RETURN n;
+END;
+$$;
+REVOKE EXECUTE ON FUNCTION refresh_student_performance(UUID[]) FROM PUBLIC, anon, authenticated;
+
+-- Publish an exam's results and update the aggregates of its students in one transaction.
+CREATE OR REPLACE FUNCTION publish_exam_results(p_exam_id UUID)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_students UUID[];
+BEGIN
+    UPDATE results SET published = TRUE WHERE exam_id = p_exam_id;
+    UPDATE exams SET status = 'results_published' WHERE id = p_exam_id;
+
+    SELECT array_agg(DISTINCT student_id) INTO v_students FROM results WHERE exam_id = p_exam_id;
+    IF v_students IS NULL THEN
+        RETURN 0;
+    END IF;
+    PERFORM refresh_student_performance(v_students);
+    RETURN cardinality(v_students);
+END;
+$$;
+REVOKE EXECUTE ON FUNCTION publish_exam_results(UUID) FROM PUBLIC, anon, authenticated;
+
+-- Change feed: cache invalidation tags on the "cache_invalidate" channel
+-- (exams, questions, results, profiles and grading_scales).
+-- Statement-level, so a bulk change sends one notification per ~7900 bytes of
+-- distinct tags ("<prefix>:<id>", comma-separated) rather than one per row.
+-- Arguments: tag prefix, key column, optional extra tag sent with every change.
+CREATE OR REPLACE FUNCTION notify_cache_change()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_keys TEXT;
+    v_tags TEXT[];
+    v_tag TEXT;
+    v_payload TEXT := '';
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        v_keys := format('SELECT %I::TEXT FROM new_rows', TG_ARGV[1]);
+    ELSIF TG_OP = 'DELETE' THEN
+        v_keys := format('SELECT %I::TEXT FROM old_rows', TG_ARGV[1]);
+    ELSE
+        v_keys := format('SELECT %1$I::TEXT FROM new_rows UNION SELECT %1$I::TEXT FROM old_rows', TG_ARGV[1]);
+    END IF;
+    EXECUTE format('SELECT array_agg(DISTINCT %L || k) FROM (%s) s(k) WHERE k IS NOT NULL', TG_ARGV[0] || ':', v_keys)
+        INTO v_tags;
+    IF v_tags IS NULL THEN
+        RETURN NULL;  -- statement touched no rows
+    END IF;
+    IF TG_NARGS > 2 THEN
+        v_tags := v_tags || TG_ARGV[2];
+    END IF;
+
+    FOREACH v_tag IN ARRAY v_tags LOOP
+        IF length(v_payload) + length(v_tag) >= 7900 THEN
+            PERFORM pg_notify('cache_invalidate', v_payload);
+            v_payload := '';
+        END IF;
+        v_payload := v_payload || CASE WHEN v_payload = '' THEN '' ELSE ',' END || v_tag;
+    END LOOP;
+    PERFORM pg_notify('cache_invalidate', v_payload);
+    RETURN NULL;
+END;
+$$;
+REVOKE EXECUTE ON FUNCTION notify_cache_change() FROM PUBLIC, anon, authenticated;
+
+-- Transition tables need one trigger per event
+DO $$
+DECLARE
+    t RECORD;
+    v_extra TEXT;
+BEGIN
+    FOR t IN SELECT * FROM (VALUES
+        ('exams', 'exam', 'id', 'admin:dashboard'),
+        ('questions', 'exam', 'exam_id', NULL),
+        ('results', 'exam_results', 'exam_id', NULL),
+        ('profiles', 'user', 'id', 'admin:dashboard'),
+        ('grading_scales', 'grading_scale', 'id', 'grading_scales')
+    ) AS v(tbl, prefix, col, extra) LOOP
+        v_extra := CASE WHEN t.extra IS NULL THEN '' ELSE format(', %L', t.extra) END;
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t.tbl || '_notify_insert', t.tbl);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t.tbl || '_notify_update', t.tbl);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t.tbl || '_notify_delete', t.tbl);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_change(%L, %L%s)',
+            t.tbl || '_notify_insert', t.tbl, t.prefix, t.col, v_extra);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_change(%L, %L%s)',
+            t.tbl || '_notify_update', t.tbl, t.prefix, t.col, v_extra);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_change(%L, %L%s)',
+            t.tbl || '_notify_delete', t.tbl, t.prefix, t.col, v_extra);
+    END LOOP;
+END;
+$$;
+
 -- ====================================================
 -- Row Level Security (RLS) Policies
 -- ====================================================
@@ -114,6 +465,10 @@ ALTER TABLE exams ENABLE ROW LEVEL SECURITY;
 ALTER TABLE questions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE submissions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE results ENABLE ROW LEVEL SECURITY;
+ALTER TABLE grading_scales ENABLE ROW LEVEL SECURITY;
+ALTER TABLE submission_drafts ENABLE ROW LEVEL SECURITY;
+ALTER TABLE job_locks ENABLE ROW LEVEL SECURITY;
+ALTER TABLE student_performance ENABLE ROW LEVEL SECURITY;
 
 -- Profiles: users can read their own profile
 CREATE POLICY "Users can view own profile" ON profiles FOR SELECT USING (auth.uid() = id);
@@ -147,6 +502,20 @@ CREATE POLICY "Teachers manage results for their exams" ON results FOR ALL USING
 );
 CREATE POLICY "Service role full access to results" ON results FOR ALL USING (auth.role() = 'service_role');
 
+-- Grading scales: managed through the API (service role) only
+CREATE POLICY "Service role full access to grading scales" ON grading_scales FOR ALL USING (auth.role() = 'service_role');
+
+-- Submission drafts: students read their own, writes go through the API
+CREATE POLICY "Students view own drafts" ON submission_drafts FOR SELECT USING (student_id = auth.uid());
+CREATE POLICY "Service role full access to drafts" ON submission_drafts FOR ALL USING (auth.role() = 'service_role');
+
+-- Job locks: background jobs only
+CREATE POLICY "Service role full access to job locks" ON job_locks FOR ALL USING (auth.role() = 'service_role');
+
+-- Student performance: students read their own aggregates
+CREATE POLICY "Students view own performance" ON student_performance FOR SELECT USING (student_id = auth.uid());
+CREATE POLICY "Service role full access to performance" ON student_performance FOR ALL USING (auth.role() = 'service_role');
+
 -- Group Messages: Everyone can read and write
 ALTER TABLE group_messages ENABLE ROW LEVEL SECURITY;
 CREATE POLICY "Users can read all group messages" ON group_messages FOR SELECT USING (true);